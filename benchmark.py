@@ -0,0 +1,690 @@
+"""
+This is a script to measure the performance of the SET computer
+"""
+import argparse
+import glob
+import json
+import os
+import queue
+import random
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import cv2 as cv
+import set_engine as se
+
+
+def random_layouts(number_of_layouts, number_of_cards, seed=0):
+    """
+    Returns a list of random layouts, each one a list of distinct cards
+    """
+    rng = random.Random(seed)
+    deck = [se.decode_card(code) for code in range(se.NUM_OF_CARDS)]
+    return [rng.sample(deck, number_of_cards) for _ in range(number_of_layouts)]
+
+
+def benchmark_batch_solver(number_of_layouts=10000, number_of_cards=12):
+    """
+    Compare the vectorized batch solver with solving layout by layout
+    """
+    layouts = random_layouts(number_of_layouts, number_of_cards)
+    layouts_arr = np.array([se.cards_to_array(cards) for cards in layouts])
+
+    start = time.perf_counter()
+    has_set_loop = [len(se.find_set_brute_force(cards)) == 3 for cards in layouts]
+    time_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    has_set_indexed = [len(se.find_set_indexed(cards)) == 3 for cards in layouts]
+    time_indexed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts_loop = [se.count_sets(cards) for cards in layouts]
+    time_count = time.perf_counter() - start
+
+    start = time.perf_counter()
+    has_set, counts, _ = se.batch_find_sets(layouts_arr)
+    time_batch = time.perf_counter() - start
+
+    if (has_set.tolist() != has_set_loop or has_set_indexed != has_set_loop
+            or counts.tolist() != counts_loop):
+        raise RuntimeError("Batch solver differs from find_set_brute_force")
+
+    print(f"Solving {number_of_layouts} layouts with {number_of_cards} cards")
+    print(f"find_set_brute_force:    {time_loop*1e3:8.1f} ms")
+    print(f"find_set_indexed:        {time_indexed*1e3:8.1f} ms")
+    print(f"count_sets:              {time_count*1e3:8.1f} ms")
+    print(f"batch_find_sets:         {time_batch*1e3:8.1f} ms "
+          f"(x{time_loop/time_batch:0.1f} to find_set_brute_force)")
+
+
+def benchmark_completion_table(repeat=100):
+    """
+    Measure the time to build the completion table at import and
+    compare is_a_set with the attribute-wise check_val
+    """
+    # pylint: disable=protected-access
+    build_time = min(timeit.repeat(se._build_completion_table, number=1, repeat=repeat))
+    print(f"Building completion table: {build_time*1e3:0.3f} ms")
+
+    cards = random_layouts(1, 3)[0]
+
+    def is_a_set_check_val():
+        return all(
+            se.check_val(*[card.get_attributes()[key] for card in cards])
+            for key in se.ATTRIBUTE_KEYS
+        )
+
+    number = 100000
+    time_table = timeit.timeit(lambda: se.is_a_set(*cards), number=number)
+    time_check_val = timeit.timeit(is_a_set_check_val, number=number)
+    print(f"is_a_set table lookup:     {time_table/number*1e6:0.3f} us")
+    print(f"is_a_set with check_val:   {time_check_val/number*1e6:0.3f} us")
+
+
+def benchmark_cnn(img_paths="Imgs/2022-*.png"):
+    """
+    Compare the learned card scorer (card_cnn) with the CCardClassifier
+
+    The images are grouped into recording sessions (same minute), the
+    network is trained on all other sessions and evaluated on the held
+    out one. The CCardClassifier labels serve as reference.
+    """
+    # pylint: disable=import-outside-toplevel
+    import card_cnn
+    from card_detection import CCardDetector
+
+    card_detector = CCardDetector()
+    sessions = {}
+    for img_path in sorted(glob.glob(img_paths)):
+        sessions.setdefault(img_path[:-7], []).append(img_path)
+
+    for session, session_paths in sessions.items():
+        train_paths = [path for path in glob.glob(img_paths) if path not in session_paths]
+        model = card_cnn.CCardCnn()
+        model.fit(*card_cnn.collect_training_data(sorted(train_paths)))
+
+        cards_per_img = [
+            card_detector.get_cards_from_img(cv.imread(path)) for path in session_paths]
+        cards = [card for img_cards in cards_per_img for card in img_cards]
+        card_ids = np.array([card.get_id() for card in cards])
+
+        start = time.perf_counter()
+        for card in cards:
+            card_detector.CardClassifier.determine_attributes(card)
+        time_classifier = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predicted_ids = np.concatenate([
+            model.predict_ids([card.get_warp(card_cnn.WARP_SIZE) for card in img_cards])
+            for img_cards in cards_per_img
+        ])
+        time_cnn = time.perf_counter() - start
+
+        same_set = [
+            se.find_set_cnn(img_cards, model) == se.find_set_indexed(img_cards)
+            for img_cards in cards_per_img
+        ]
+        attribute_accuracy = (
+            se.codes_to_array(predicted_ids) == se.codes_to_array(card_ids)).mean(axis=0)
+
+        print(f"Session {session} ({len(session_paths)} images, {len(cards)} cards)")
+        print(f"  CCardClassifier: {time_classifier/len(cards)*1e3:6.2f} ms per card")
+        print(f"  card_cnn:        {time_cnn/len(cards)*1e3:6.2f} ms per card")
+        print(f"  card accuracy:   {np.mean(predicted_ids == card_ids):0.3f}, per attribute "
+              + ", ".join(f"{key} {accuracy:0.3f}"
+                          for key, accuracy in zip(se.ATTRIBUTE_KEYS, attribute_accuracy)))
+        print(f"  same SET found:  {np.mean(same_set):0.3f}")
+
+
+def benchmark_parallel_classification(img_path="Imgs/2022-08-10_18-33-28.png", repeat=30):
+    """
+    Compare per-frame latency of serial and parallel card classification
+    """
+    from card_detection import CCardDetector  # pylint: disable=import-outside-toplevel
+
+    raw = cv.imread(img_path)
+    modes = {
+        "serial": CCardDetector(),
+        "4 threads": CCardDetector(workers=4),
+        "4 processes": CCardDetector(workers=4, use_processes=True),
+    }
+    reference = None
+    for mode, card_detector in modes.items():
+        cards = card_detector.get_cards_from_img(raw)  # warm up, starts the pool
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cards = card_detector.get_cards_from_img(raw)
+            times.append(time.perf_counter() - start)
+        card_detector.close()
+
+        attributes = [card.get_card() for card in cards]
+        if reference is None:
+            reference = attributes
+        elif attributes != reference:
+            raise RuntimeError(f"Classification with {mode} differs from serial")
+        print(f"{mode:12s}: {len(cards)} cards, {np.median(times)*1e3:6.1f} ms per frame (median)")
+
+
+def benchmark_detection_scale(img_paths="Imgs/*.png", scales=(1.0, 0.75, 0.5), repeat=5):
+    """
+    Compare card detection time and results of downscaled contour search
+    with the full resolution
+    """
+    from card_detection import CCardDetector  # pylint: disable=import-outside-toplevel
+
+    raws = [cv.imread(path) for path in sorted(glob.glob(img_paths))]
+    reference = None
+    for scale in scales:
+        card_detector = CCardDetector(detection_scale=scale)
+        times = []
+        results = []
+        for raw in raws:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                qcards = card_detector.detect_cards(raw)
+                times.append(time.perf_counter() - start)
+            cards = card_detector.classify_detected_cards(qcards)
+            results.append(sorted(card.get_id() for card in cards))
+
+        if reference is None:
+            reference = results
+        differ = sum(result != ref for result, ref in zip(results, reference))
+        print(f"Scale {scale:4.2f}: {np.median(times)*1e3:6.2f} ms detection per frame (median), "
+              f"{differ} of {len(raws)} images differ from scale {scales[0]}")
+
+
+def benchmark_lazy_warping(img_paths="Imgs/*.png", frames_per_img=10):
+    """
+    Measure how many cards are flattened per frame and the time per frame
+    of eager warping, lazy warping with tracking and the warp buffer pool,
+    every image is repeated to simulate a static game field
+    """
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CCardDetector
+    from card_tracking import CCardTracker
+
+    raws = [cv.imread(path) for path in sorted(glob.glob(img_paths))]
+    modes = {
+        "eager": (CCardDetector(), True),
+        "lazy": (CCardDetector(), False),
+        "lazy + tracking": (CCardDetector(tracker=CCardTracker(1, 1)), False),
+        "lazy + tracking + pool": (
+            CCardDetector(tracker=CCardTracker(1, 1), warp_buffers=32), False),
+    }
+    reference = None
+    for mode, (card_detector, eager) in modes.items():
+        results = []
+        times = []
+        warped = 0
+        detected = 0
+        for raw in raws:
+            for _ in range(frames_per_img):
+                start = time.perf_counter()
+                qcards = card_detector.detect_cards(raw)
+                if eager:
+                    for qcard in qcards:
+                        _ = qcard.warp
+                cards = card_detector.classify_detected_cards(qcards)
+                times.append(time.perf_counter() - start)
+                detected += len(qcards)
+                # pylint: disable=protected-access
+                warped += sum(qcard._warp is not None for qcard in qcards)
+            results.append(sorted(card.get_id() for card in cards))
+
+        if reference is None:
+            reference = results
+        differ = sum(result != ref for result, ref in zip(results, reference))
+        print(f"{mode:24s}: {np.mean(times)*1e3:6.2f} ms per frame (mean), "
+              f"{warped/detected:0.2f} of cards flattened, "
+              f"{differ} of {len(raws)} images differ from {list(modes)[0]}")
+        if card_detector.buffer_pool is not None:
+            print(f"{'':26s}{card_detector.buffer_pool.allocated} buffers allocated "
+                  f"for {card_detector.buffer_pool.acquired} warps")
+
+
+def benchmark_debug_images(img_paths="Imgs/*.png"):
+    """
+    Compare memory per frame and classification time per card with and
+    without keeping the debug images of the CCardClassifier
+    """
+    from card_detection import CCardDetector  # pylint: disable=import-outside-toplevel
+
+    raws = [cv.imread(path) for path in sorted(glob.glob(img_paths))]
+    reference = None
+    for debug_images in (True, False):
+        card_detector = CCardDetector(debug_images=debug_images)
+        results = []
+        times = []
+        peaks = []
+        kept = []
+        num_of_cards = 0
+        for raw in raws:
+            qcards = card_detector.detect_cards(raw)
+            for qcard in qcards:
+                _ = qcard.warp  # only measure the classification
+            tracemalloc.start()
+            start = time.perf_counter()
+            cards = card_detector.classify_detected_cards(qcards)
+            times.append(time.perf_counter() - start)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            num_of_cards += len(qcards)
+            kept.append(sum(
+                getattr(qcard, name).nbytes for qcard in qcards
+                for name in qcard.CLASSIFIER_OUTPUTS
+                if isinstance(getattr(qcard, name), np.ndarray)))
+            results.append([card.get_id() for card in cards])
+
+        if reference is None:
+            reference = results
+        elif results != reference:
+            raise RuntimeError("Classification without debug images differs")
+
+        # images on demand are the same as the kept ones
+        on_demand = cards[0].get_img("warp_color_detection")
+        print(f"debug_images={debug_images!s:5s}: "
+              f"{sum(times)/num_of_cards*1e3:5.2f} ms per card, "
+              f"{np.mean(kept)/1e6:5.2f} MB images kept per frame, "
+              f"{np.mean(peaks)/1e6:5.2f} MB peak allocation per frame, "
+              f"{on_demand.nbytes/1e3:0.0f} kB warp_color_detection on demand")
+
+
+def reference_card_features(warp, inner_mask, center_box):
+    """
+    Color and shading statistics of a card calculated with float64 white
+    balance and full HSV/HLS conversions, as reference for calc_features
+    """
+    white = cv.mean(warp, mask=~inner_mask)[:3]
+    balanced = np.clip(cv.merge([
+        channel / white_channel for channel, white_channel in zip(cv.split(warp), white)]), 0, 1)
+    symbol_means = cv.mean(balanced, mask=inner_mask)[:3]
+    min_value = np.amin(cv.cvtColor(np.float32(balanced), cv.COLOR_BGR2HSV)[:, :, 2])
+    x0, y0, x1, y1 = center_box
+    box = np.float32(balanced[y0:y1, x0:x1])
+    saturation = cv.cvtColor(box, cv.COLOR_BGR2HSV)[:, :, 1].mean()
+    lightness = cv.cvtColor(box, cv.COLOR_BGR2HLS)[:, :, 1].mean()
+    return symbol_means, min_value, saturation, lightness
+
+
+def _preprocessed_cards(card_detector, img_paths):
+    """Returns the cards with symbols of all images, flattened again as
+    in the classification, and their symbol masks"""
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CQueryCard
+
+    cards = []
+    for path in sorted(glob.glob(img_paths)):
+        for qcard in card_detector.detect_cards(cv.imread(path)):
+            if qcard.warp is not None:
+                cards.append(CQueryCard.from_warp(qcard.warp))
+    masks = [card_detector.CardClassifier.preprocess_card_img(card) for card in cards]
+    cards, masks = zip(*[
+        (card, mask) for card, mask in zip(cards, masks) if len(card.symbol_contours) > 0])
+    return cards, masks
+
+
+def benchmark_card_features(img_paths="Imgs/*.png", repeat=5):
+    """
+    Compare the fused float32 color and shading statistics of the
+    CCardClassifier with the separate float64/HSV/HLS calculation
+    """
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CCardDetector
+
+    card_detector = CCardDetector()
+    classifier = card_detector.CardClassifier
+    cards, masks = _preprocessed_cards(card_detector, img_paths)
+
+    def fused():
+        features = []
+        for card, mask in zip(cards, masks):
+            classifier.correct_white_balance(card, mask)
+            features.append(classifier.calc_features(card, mask))
+        return features
+
+    features = fused()
+    references = [
+        reference_card_features(card.warp, mask, feature.center_box)
+        for card, mask, feature in zip(cards, masks, features)
+    ]
+    max_diff = max(
+        np.abs(np.subtract(
+            [*feature.symbol_means, feature.min_value, feature.saturation, feature.lightness],
+            [*reference[0], *reference[1:]])).max()
+        for feature, reference in zip(features, references)
+    )
+
+    time_fused = min(timeit.repeat(fused, number=1, repeat=repeat))
+    time_reference = min(timeit.repeat(
+        lambda: [reference_card_features(card.warp, mask, feature.center_box)
+                 for card, mask, feature in zip(cards, masks, features)],
+        number=1, repeat=repeat))
+    print(f"{len(cards)} cards, max difference of the statistics {max_diff:0.2e}")
+    print(f"float64 + HSV/HLS:  {time_reference/len(cards)*1e3:6.3f} ms per card")
+    print(f"fused float32:      {time_fused/len(cards)*1e3:6.3f} ms per card "
+          f"(x{time_reference/time_fused:0.1f})")
+
+
+def benchmark_symbol_matching(img_paths="Imgs/*.png", repeat=7):
+    """
+    Compare symbol classification of the first symbol of a card with
+    voting over all symbols
+    """
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CCardDetector
+    from card_classifier import CCardClassifier
+
+    cards, masks = _preprocessed_cards(CCardDetector(), img_paths)
+
+    reference = None
+    for vote_symbols in (False, True):
+        classifier = CCardClassifier(vote_symbols=vote_symbols)
+        duration = min(timeit.repeat(
+            lambda: [classifier.calc_symbol(card, mask) for card, mask in zip(cards, masks)],
+            number=1, repeat=repeat))
+        symbols = [card.get_symbol() for card in cards]
+        if reference is None:
+            reference = symbols
+        changed = sum(symbol != ref for symbol, ref in zip(symbols, reference))
+        print(f"vote_symbols={vote_symbols!s:5s}: {duration/len(cards)*1e3:0.3f} ms per card, "
+              f"{symbols.count('')} of {len(cards)} symbols unknown, "
+              f"{changed} changed by voting")
+
+
+def benchmark_stream(source="Imgs/", fps=0, duration=10):
+    """
+    Load test the threaded pipeline with a replayed frame source,
+    unthrottled with fps 0, headless and without camera
+    """
+    # pylint: disable=import-outside-toplevel
+    from camera_stream import CCameraStream, create_frame_source
+    from card_detection import CCardDetector, CSceneChangeGate
+    from card_tracking import CCardTracker, CSetCache
+    from frame_pipeline import CFramePipeline
+
+    cam_stream = CCameraStream(fps=fps, source=create_frame_source(source))
+    card_detector = CCardDetector(tracker=CCardTracker(), gate=CSceneChangeGate())
+    pipeline = CFramePipeline(
+        lambda: cam_stream.get_latest(timeout=0.5), card_detector,
+        CSetCache(se.find_set_indexed).get_set, max_fps=0)
+    cam_stream.run()
+    pipeline.run()
+    end = time.perf_counter() + duration
+    results = 0
+    while time.perf_counter() < end and cam_stream.running:
+        try:
+            pipeline.get_result(timeout=0.5)
+            results += 1
+        except queue.Empty:
+            pass
+    pipeline.stop()
+    cam_stream.stop()
+    card_detector.close()
+
+    print(f"{source}: {results/duration:0.1f} results per second")
+    pipeline.print_report()
+    print("Frame source:", cam_stream.get_report())
+
+
+def _pickled_frame_worker(frames, results):
+    """Receive pickled frames and send back a small result"""
+    while True:
+        seq, img = frames.get()
+        if img is None:
+            return
+        results.put((seq, int(img[0, 0, 0])))
+
+
+def _shared_frame_worker(ring, results, stop_event):
+    """Claim frames of the shared ring and send back a small result"""
+    frame = None
+    while not stop_event.is_set():
+        frame = ring.claim_latest(timeout=0.1)
+        if frame is not None:
+            value = int(frame.img[0, 0, 0])
+            ring.release(frame)
+            results.put((frame.seq, value))
+    del frame
+    ring.close()
+
+
+def benchmark_frame_transport(img_path="Imgs/2022-08-10_18-33-28.png", number=200):
+    """
+    Compare the round trip time of handing a frame to another process by
+    pickling it through a queue and through the shared memory ring
+    """
+    # pylint: disable=import-outside-toplevel
+    from multiprocessing import Event, Process, Queue
+    from shared_frames import CSharedFrameRing, CSharedFrameDetection, records_to_cards
+
+    img = cv.imread(img_path)
+
+    frames, results = Queue(maxsize=1), Queue()
+    worker = Process(target=_pickled_frame_worker, args=(frames, results))
+    worker.start()
+    start = time.perf_counter()
+    for seq in range(number):
+        frames.put((seq, img))
+        results.get()
+    time_pickled = time.perf_counter() - start
+    frames.put((None, None))
+    worker.join()
+
+    ring = CSharedFrameRing(img.shape)
+    stop_event = Event()
+    worker = Process(target=_shared_frame_worker, args=(ring, results, stop_event))
+    worker.start()
+    start = time.perf_counter()
+    for _ in range(number):
+        ring.put(img)
+        results.get()
+    time_shared = time.perf_counter() - start
+    stop_event.set()
+    worker.join()
+
+    print(f"Frame {img.nbytes/1e6:0.1f} MB, round trip to another process")
+    print(f"pickled through a queue: {time_pickled/number*1e3:6.2f} ms per frame")
+    print(f"shared memory ring:      {time_shared/number*1e3:6.2f} ms per frame")
+
+    detection = CSharedFrameDetection(ring)
+    detection.run()
+    ring.put(img)
+    detection.get_result()  # first pass of the tracker
+    start = time.perf_counter()
+    for _ in range(20):
+        ring.put(img)
+        result = detection.get_result()
+    time_detection = time.perf_counter() - start
+    detection.stop()
+    ring.close()
+    cards, _ = records_to_cards(result.records)
+    print(f"detection worker:        {time_detection/20*1e3:6.2f} ms per static frame, "
+          f"{len(cards)} cards in a {result.records.nbytes} bytes result")
+
+
+def load_labels(labels_path="Imgs/labels.json"):
+    """
+    Returns the ground truth of the labels file as dict of image file name
+    to list of (center, CCard), the SET existence follows from the cards
+    """
+    with open(labels_path, encoding="utf-8") as labels_file:
+        labels = json.load(labels_file)
+    ground_truth = {}
+    for img_name, entries in labels.items():
+        ground_truth[img_name] = []
+        for entry in entries:
+            number, symbol, shading, color = entry["card"].split()
+            ground_truth[img_name].append(
+                (tuple(entry["center"]), se.CCard(int(number), symbol, shading, color)))
+    return ground_truth
+
+
+def match_labelled_cards(cards, labelled, max_dist):
+    """Returns pairs (card, labelled card) of the closest centers, greedy"""
+    pairs = sorted(
+        (np.hypot(card.center[0] - center[0], card.center[1] - center[1]), i, j)
+        for i, card in enumerate(cards)
+        for j, (center, _) in enumerate(labelled))
+    used_cards, used_labels = set(), set()
+    matches = []
+    for dist, i, j in pairs:
+        if dist > max_dist or i in used_cards or j in used_labels:
+            continue
+        used_cards.add(i)
+        used_labels.add(j)
+        matches.append((cards[i], labelled[j][1]))
+    return matches
+
+
+def _latency_stats(times):
+    """Returns percentiles of times in seconds as dict in ms"""
+    times_ms = np.array(times) * 1e3
+    return {
+        "p50": round(float(np.percentile(times_ms, 50)), 3),
+        "p90": round(float(np.percentile(times_ms, 90)), 3),
+        "p99": round(float(np.percentile(times_ms, 99)), 3),
+        "max": round(float(times_ms.max()), 3),
+    }
+
+
+def benchmark_end_to_end(labels_path="Imgs/labels.json", output=None, repeat=3,
+                         detection_scale=0.5, vote_symbols=True):
+    """
+    Run detect -> classify -> solve over all labelled images, headless and
+    without camera, and compare the result with the ground truth
+
+    Reports latency percentiles of every stage, the throughput and the
+    accuracy of card count, cards, attributes and SET existence. With
+    output the report is written as JSON file to diff it between commits.
+    """
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CCardDetector
+    from card_tracking import MAX_MATCH_DIST
+
+    ground_truth = load_labels(labels_path)
+    img_dir = os.path.dirname(labels_path)
+    card_detector = CCardDetector(detection_scale=detection_scale, vote_symbols=vote_symbols)
+    stages = ("detect", "classify", "solve", "total")
+    times = {stage: [] for stage in stages}
+    per_image = {}
+    attribute_hits = np.zeros(len(se.ATTRIBUTE_KEYS))
+    matched = detected = labelled_cards = correct = 0
+
+    for img_name, labelled in ground_truth.items():
+        raw = cv.imread(os.path.join(img_dir, img_name))
+        for _ in range(repeat):
+            start = time.perf_counter()
+            qcards = card_detector.detect_cards(raw)
+            detected_time = time.perf_counter()
+            cards = card_detector.classify_detected_cards(qcards)
+            classified_time = time.perf_counter()
+            set_cards = se.find_set_indexed(cards)
+            end = time.perf_counter()
+            times["detect"].append(detected_time - start)
+            times["classify"].append(classified_time - detected_time)
+            times["solve"].append(end - classified_time)
+            times["total"].append(end - start)
+
+        matches = match_labelled_cards(cards, labelled, MAX_MATCH_DIST)
+        matched += len(matches)
+        detected += len(cards)
+        labelled_cards += len(labelled)
+        img_correct = sum(card.get_id() == truth.get_id() for card, truth in matches)
+        correct += img_correct
+        for card, truth in matches:
+            attribute_hits += [
+                card.get_attributes()[key] == truth.get_attributes()[key]
+                for key in se.ATTRIBUTE_KEYS]
+        per_image[img_name] = {
+            "cards": len(cards),
+            "labelled_cards": len(labelled),
+            "correct_cards": img_correct,
+            "has_set": bool(set_cards),
+            "labelled_has_set": bool(se.find_set_indexed([card for _, card in labelled])),
+        }
+    card_detector.close()
+
+    def fraction(count, total):
+        return round(count / max(total, 1), 4)
+
+    num_of_imgs = len(per_image)
+    report = {
+        "images": num_of_imgs,
+        "repeat": repeat,
+        "detection_scale": detection_scale,
+        "vote_symbols": vote_symbols,
+        "latency_ms": {stage: _latency_stats(times[stage]) for stage in stages},
+        "throughput_fps": round(len(times["total"]) / sum(times["total"]), 2),
+        "accuracy": {
+            "card_count": fraction(
+                sum(img["cards"] == img["labelled_cards"] for img in per_image.values()),
+                num_of_imgs),
+            "detection_recall": fraction(matched, labelled_cards),
+            "detection_precision": fraction(matched, detected),
+            "cards": fraction(correct, labelled_cards),
+            "attributes": {
+                key: fraction(hits, matched)
+                for key, hits in zip(se.ATTRIBUTE_KEYS, attribute_hits)},
+            "set_existence": fraction(
+                sum(img["has_set"] == img["labelled_has_set"] for img in per_image.values()),
+                num_of_imgs),
+        },
+        "per_image": per_image,
+    }
+
+    print(f"{num_of_imgs} images, {labelled_cards} labelled cards, {repeat} runs each")
+    for stage in stages:
+        stats = report["latency_ms"][stage]
+        print(f"{stage:8s}: p50 {stats['p50']:7.2f} ms, p90 {stats['p90']:7.2f} ms, "
+              f"p99 {stats['p99']:7.2f} ms, max {stats['max']:7.2f} ms")
+    print(f"Throughput: {report['throughput_fps']:0.1f} frames per second")
+    accuracy = report["accuracy"]
+    print(f"Card count correct: {accuracy['card_count']:0.3f} of images, "
+          f"detection recall {accuracy['detection_recall']:0.3f}, "
+          f"precision {accuracy['detection_precision']:0.3f}")
+    print(f"Cards correct: {accuracy['cards']:0.3f}, per attribute "
+          + ", ".join(f"{key} {value:0.3f}" for key, value in accuracy["attributes"].items()))
+    print(f"SET existence correct: {accuracy['set_existence']:0.3f} of images")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+            output_file.write("\n")
+        print(f"Wrote {output}")
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--layouts", type=int, default=10000)
+    parser.add_argument("--cards", type=int, default=12)
+    parser.add_argument("--source", default="Imgs/",
+                        help="frame source of the stream benchmark, see camera_stream")
+    parser.add_argument("--fps", type=float, default=0,
+                        help="frame rate of the stream benchmark, 0: unthrottled")
+    parser.add_argument("--labels", default="Imgs/labels.json",
+                        help="ground truth of the e2e benchmark, images in the same directory")
+    parser.add_argument("--output", help="JSON file for the report of the e2e benchmark")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per image of the e2e benchmark")
+
+    BENCHMARKS = {
+        "batch": lambda args: benchmark_batch_solver(args.layouts, args.cards),
+        "table": lambda args: benchmark_completion_table(),
+        "cnn": lambda args: benchmark_cnn(),
+        "classify": lambda args: benchmark_parallel_classification(),
+        "detect": lambda args: benchmark_detection_scale(),
+        "warp": lambda args: benchmark_lazy_warping(),
+        "debug": lambda args: benchmark_debug_images(),
+        "features": lambda args: benchmark_card_features(),
+        "symbols": lambda args: benchmark_symbol_matching(),
+        "stream": lambda args: benchmark_stream(args.source, args.fps),
+        "shm": lambda args: benchmark_frame_transport(),
+        "e2e": lambda args: benchmark_end_to_end(args.labels, args.output, args.repeat),
+    }
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    Args = parser.parse_args()
+    BENCHMARKS[Args.benchmark](Args)
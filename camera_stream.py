@@ -1,13 +1,93 @@
+"""Module to stream frames of a camera or another frame source
+
+The frames are read in a thread into a CFrameRingBuffer. Frame sources
+have a read() method returning the next BGR img or None at the end and a
+close() method. Besides the PiCamera (only imported if used) frames can
+be streamed from a directory of images, a video file or a list of imgs
+in memory, so the pipeline also runs on hosts without camera.
+"""
+import glob
+import os
 import time
-from threading import Thread
+from collections import deque, namedtuple
+from threading import Thread, Condition
+import numpy as np
 import cv2 as cv
-from picamera.array import PiRGBArray
-from picamera import PiCamera
 
+# Frame of the CFrameRingBuffer, timestamp in time.perf_counter() seconds
+CameraFrame = namedtuple("CameraFrame", ["seq", "timestamp", "img"])
+
+
+class CFrameRingBuffer:
+    """Fixed number of preallocated frame slots, a new frame overwrites
+    the oldest one. Frames are numbered from 1 by their sequence number."""
+    def __init__(self, shape=None, num_of_slots=4):
+        """shape of the frames, if None the slots are allocated with the
+        first frame"""
+        self.num_of_slots = num_of_slots
+        self.slots = None if shape is None else np.empty((num_of_slots,) + tuple(shape), np.uint8)
+        self.timestamps = [0.0] * num_of_slots
+        self.seq = 0 # sequence number of the latest frame, 0 before the first one
+        self.last_returned = 0 # sequence number of the latest frame returned
+        self.cond = Condition()
+
+        self.dropped = 0 # frames overwritten without being returned
+        self.duplicates = 0 # frames returned more than once by get
+
+    def put(self, img, timestamp=None):
+        """Copy img into the next slot and wake up waiting readers"""
+        with self.cond:
+            if self.slots is None or self.slots.shape[1:] != img.shape:
+                self.slots = np.empty((self.num_of_slots,) + img.shape, np.uint8)
+            slot = self.seq % self.num_of_slots
+            np.copyto(self.slots[slot], img)
+            self.timestamps[slot] = time.perf_counter() if timestamp is None else timestamp
+            self.seq += 1
+            self.cond.notify_all()
+
+    def get_latest(self, newer_than=None, timeout=None, copy=True):
+        """Returns the latest CameraFrame, waits until there is a frame
+        with a sequence number greater than newer_than (by default the
+        last returned one). Returns None after timeout seconds.
+        Without copy the img is a view of the slot, which is only valid
+        until num_of_slots - 1 further frames are put."""
+        with self.cond:
+            if newer_than is None:
+                newer_than = self.last_returned
+            if not self.cond.wait_for(lambda: self.seq > newer_than, timeout):
+                return None
+            return self.__read(copy)
+
+    def get(self, copy=True):
+        """Returns the latest CameraFrame without waiting,
+        None before the first frame"""
+        with self.cond:
+            if self.seq == 0:
+                return None
+            return self.__read(copy)
+
+    def __read(self, copy):
+        if self.seq == self.last_returned:
+            self.duplicates += 1
+        else:
+            self.dropped += self.seq - self.last_returned - 1
+            self.last_returned = self.seq
+        slot = (self.seq - 1) % self.num_of_slots
+        img = self.slots[slot].copy() if copy else self.slots[slot]
+        return CameraFrame(self.seq, self.timestamps[slot], img)
+
+
+class CPiCameraSource:
+    """Frames of the PiCamera, paced by the camera frame rate"""
+    paced = True
+    warm_up_time = 2 # seconds
 
-class CCameraStream:
-    """Camera Stream"""
     def __init__(self, res, fps):
+        # picamera is only available on the Raspberry Pi
+        # pylint: disable=import-outside-toplevel
+        from picamera.array import PiRGBArray
+        from picamera import PiCamera
+
         self.camera = PiCamera()
         self.camera.resolution = res
         self.camera.framerate = fps
@@ -15,8 +95,106 @@ class CCameraStream:
         self.stream = self.camera.capture_continuous(
             self.raw_capture, format="bgr", use_video_port=True)
 
-        # Init variable to buffer camera frame
-        self.recent_frame = []
+    def read(self):
+        """Returns the next camera frame"""
+        frame = next(self.stream)
+        self.raw_capture.truncate(0)
+        return frame.array
+
+    def close(self):
+        """Close camera resources"""
+        self.stream.close()
+        self.raw_capture.close()
+        self.camera.close()
+
+
+class CReplaySource:
+    """Frames of a list of imgs in memory"""
+    paced = False
+    warm_up_time = 0
+
+    def __init__(self, imgs, loop=True):
+        self.imgs = list(imgs)
+        self.loop = loop
+        self.index = 0
+
+    def read(self):
+        """Returns the next img, None at the end"""
+        if self.index >= len(self.imgs):
+            if not self.loop or not self.imgs:
+                return None
+            self.index = 0
+        img = self.imgs[self.index]
+        self.index += 1
+        return img
+
+    def close(self):
+        """Nothing to close"""
+
+
+class CImageDirSource(CReplaySource):
+    """Frames of the images of a directory or glob pattern in name order,
+    the images are loaded once"""
+    def __init__(self, path, loop=True):
+        pattern = os.path.join(path, "*.png") if os.path.isdir(path) else path
+        paths = sorted(glob.glob(pattern))
+        if not paths:
+            raise ValueError(f"No images found for {path}")
+        super().__init__([cv.imread(img_path) for img_path in paths], loop)
+
+
+class CVideoFileSource:
+    """Frames of a video file"""
+    paced = False
+    warm_up_time = 0
+
+    def __init__(self, path, loop=True):
+        self.capture = cv.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Can not open video {path}")
+        self.loop = loop
+
+    def read(self):
+        """Returns the next frame, None at the end"""
+        ok, img = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(cv.CAP_PROP_POS_FRAMES, 0)
+            ok, img = self.capture.read()
+        return img if ok else None
+
+    def close(self):
+        """Release the video file"""
+        self.capture.release()
+
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".h264")
+
+
+def create_frame_source(name, res=(1280, 720), fps=30, loop=True):
+    """Returns the frame source of name:
+    "picamera", a video file, or a directory or glob pattern of images"""
+    if name == "picamera":
+        return CPiCameraSource(res, fps)
+    if name.lower().endswith(VIDEO_EXTENSIONS):
+        return CVideoFileSource(name, loop)
+    return CImageDirSource(name, loop)
+
+
+class CCameraStream:
+    """Camera Stream"""
+    def __init__(self, res=(1280, 720), fps=30, num_of_slots=4, source=None, buffer=None):
+        """source is a frame source, by default the PiCamera with res and
+        fps. Sources which are not paced like a camera are read with at
+        most fps frames per second, unthrottled if fps is 0 or None.
+        buffer is the ring the frames are written to, by default a
+        CFrameRingBuffer of num_of_slots, a shared_frames.CSharedFrameRing
+        hands the frames to other processes without copying"""
+        self.source = CPiCameraSource(res, fps) if source is None else source
+        self.min_frame_interval = 1 / fps if fps and not self.source.paced else 0
+
+        # Ring buffer of the last camera frames
+        self.buffer = CFrameRingBuffer(num_of_slots=num_of_slots) if buffer is None else buffer
+        self.latencies = deque(maxlen=100) # capture to mark_displayed in seconds
 
         self.running = False
 
@@ -25,23 +203,48 @@ class CCameraStream:
         self.running = True
         Thread(target=self.__update, args=()).start()
         # Wat for camera to 'warm up'
-        time.sleep(2)
+        time.sleep(self.source.warm_up_time)
 
     def __update(self):
-        """Update frame buffer"""
-        for frame in self.stream:
-            if self.running:
-                self.recent_frame = frame.array
-                self.raw_capture.truncate(0)
-            else:
-                # Close camera resources
-                self.stream.close()
-                self.raw_capture.close()
-                self.camera.close()
+        """Update frame buffer until stopped or the source ends"""
+        next_frame_time = time.perf_counter()
+        while self.running:
+            wait = next_frame_time - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            next_frame_time = max(next_frame_time, time.perf_counter()) + self.min_frame_interval
+
+            img = self.source.read()
+            if img is None:
+                break
+            self.buffer.put(img, time.perf_counter())
+        self.running = False
+        self.source.close()
 
     def get(self):
-        """Return recent frame"""
-        return self.recent_frame
+        """Return recent frame, also if it was returned before"""
+        frame = self.buffer.get()
+        return [] if frame is None else frame.img
+
+    def get_latest(self, newer_than=None, timeout=None):
+        """Return the recent CameraFrame (seq, timestamp, img), waits for
+        a frame newer than newer_than or the last returned one,
+        None after timeout seconds"""
+        return self.buffer.get_latest(newer_than, timeout)
+
+    def mark_displayed(self, frame):
+        """Record the capture to display latency of a CameraFrame"""
+        self.latencies.append(time.perf_counter() - frame.timestamp)
+
+    def get_report(self):
+        """Returns dict with frame counters and the mean latency"""
+        return {
+            "frames": self.buffer.seq,
+            "dropped": self.buffer.dropped,
+            "duplicates": self.buffer.duplicates,
+            "latency_ms": (
+                sum(self.latencies) / len(self.latencies) * 1e3 if self.latencies else 0),
+        }
 
     def stop(self):
         """Stop CameraStream"""
@@ -57,7 +260,7 @@ if __name__ == '__main__':
     time.sleep(2)
 
     for i in range(10):
-        img = CamStream.get()
+        img = CamStream.get_latest(timeout=1).img
         now = datetime.today().strftime(r'%Y-%m-%d_%H-%M-%S')
         cv.imwrite(f'Imgs/{now}.png', img)
         cv.namedWindow("window", cv.WND_PROP_FULLSCREEN)
@@ -1,50 +1,109 @@
+from collections import namedtuple
 import numpy as np
 import cv2 as cv
+import profiling
 import set_engine as se
 
 SYMBOL_MIN_AREA = 4000
 SYMBOL_REF_PATH = "symbol_reference"
+SYMBOL_SIZE = (70, 32)  # width, height all symbols are compared in
+
+# Statistics of the white balanced card img used by calc_color and calc_shading
+CardFeatures = namedtuple("CardFeatures", [
+    "symbol_means",  # mean (b, g, r) inside the symbols
+    "min_value",  # min HSV value of the card
+    "center_box",  # (x0, y0, x1, y1) of the center of the first symbol
+    "saturation",  # mean HSV saturation of the center box
+    "lightness",  # mean HLS lightness of the center box
+])
 
 class CCardClassifier:
     """Class to classify attributes of the cards"""
-    def __init__(self):
-        symbols = se.possible_attributes["symbol"]
-        self.symbol_reference = {}
-        for symbol_name in symbols:
-            self.symbol_reference[symbol_name] = \
-                cv.imread(f"{SYMBOL_REF_PATH}/{symbol_name}.png")
-
-    def determine_attributes(self, card):
+    def __init__(self, debug=False, vote_symbols=False):
+        """debug keeps all images of the classification in the card and
+        draws the measured values into them, otherwise the images are
+        dropped after classification and calculated again on demand by
+        calc_debug_images
+        vote_symbols compares all symbols of a card with the reference
+        symbols and votes, otherwise only the first one"""
+        self.debug = debug
+        self.vote_symbols = vote_symbols
+        self.symbol_names = se.possible_attributes["symbol"]
+        # reference symbols of the same size stacked to compare them at once
+        self.symbol_reference = np.stack([
+            self.normalize_symbol(
+                cv.imread(f"{SYMBOL_REF_PATH}/{symbol_name}.png", cv.IMREAD_GRAYSCALE))
+            for symbol_name in self.symbol_names
+        ])
+
+    def determine_attributes(self, card, debug=None):
         """ Determines attributes of given qcard """
+        if debug is None:
+            debug = self.debug
         if card.warp is None:
             return card
-        self.preprocess_card_img(card)
+        card.classifier = self
+        inner_mask = self.preprocess_card_img(card)
         if len(card.symbol_contours) > 0:
+            features = self.calc_features(card, inner_mask)
 
             self.calc_number(card)
-            self.calc_symbol(card)
-            self.calc_color(card)
-            self.calc_shading(card)
+            self.calc_symbol(card, inner_mask)
+            self.calc_color(card, features, debug)
+            self.calc_shading(card, features, debug)
 
+        if not debug:
+            card.clear_images()
         return card
 
-    def correct_white_balance(self, card):
+    def calc_debug_images(self, card):
+        """Calculate all images of the classification of an already
+        classified card, the attributes of the card are kept"""
+        values = card.get_card()
+        self.determine_attributes(card, debug=True)
+        card.set_card(values)
+
+    @profiling.timed("classify.white_balance")
+    def correct_white_balance(self, card, inner_mask):
         """Calc the mean of the outer area of the card,
         is a perfect white in reality and ajust img balance"""
-        inner_mask, _, _ = cv.split(card.symbol_mask)
         white_b, white_g, white_r, _ = cv.mean(card.warp, mask=~inner_mask)
 
+        # float32 img in 0..1, scaled per channel in one pass
+        balanced = cv.multiply(card.warp, (1 / white_b, 1 / white_g, 1 / white_r, 0),
+                               dtype=cv.CV_32F)
+        card.warp_white_balanced = np.minimum(balanced, 1, out=balanced)
 
-        img_b, img_g, img_r = cv.split(card.warp)
+    @profiling.timed("classify.features")
+    def calc_features(self, card, inner_mask):
+        """Calc all statistics of the white balanced img needed for
+        color and shading at once, without converting the img to HSV/HLS"""
+        img = card.warp_white_balanced
 
-        img_b = img_b / white_b
-        img_g = img_g / white_g
-        img_r = img_r / white_r
+        # calc mean of each color channel inside the symbol contour
+        mean_b, mean_g, mean_r, _ = cv.mean(img, mask=inner_mask)
 
-        card.warp_white_balanced = np.clip(cv.merge([img_b, img_g, img_r]),0,1)
+        # HSV value is the max channel
+        img_b, img_g, img_r = cv.split(img)
+        min_value, _, _, _ = cv.minMaxLoc(cv.max(cv.max(img_b, img_g), img_r))
 
+        # Pick only small part of the center of the first symbol
+        x,y,w,h = cv.boundingRect(card.symbol_contours[0])
+        x0, y0, x1, y1 = int(x+0.4*w), int(y+0.4*h), int(x+0.6*w), int(y+0.6*h)
+        box_b, box_g, box_r = cv.split(img[y0:y1, x0:x1])
+        box_max = cv.max(cv.max(box_b, box_g), box_r)
+        box_min = cv.min(cv.min(box_b, box_g), box_r)
+        # as HSV saturation and HLS lightness of cv.cvtColor for float imgs
+        saturation = cv.mean(
+            cv.divide(box_max - box_min, box_max + np.finfo(np.float32).eps))[0]
+        lightness = cv.mean(box_max + box_min)[0] * 0.5
+
+        return CardFeatures(
+            (mean_b, mean_g, mean_r), min_value, (x0, y0, x1, y1), saturation, lightness)
+
+    @profiling.timed("classify.preprocess")
     def preprocess_card_img(self, card):
-        """Preprocess flatten card image"""
+        """Preprocess flatten card image, returns the 1-channel symbol mask"""
         flatten = card.warp
         grey = cv.cvtColor(flatten, cv.COLOR_BGR2GRAY)
         blur = cv.GaussianBlur(grey, (3, 3), 0)
@@ -57,17 +116,17 @@ class CCardClassifier:
         contours = contours[0] if len(contours) == 2 else contours[1]
 
         # draw filled contour on black background
-        mask = np.zeros_like(flatten, dtype="uint8")
+        inner_mask = np.zeros(flatten.shape[:2], dtype="uint8")
         contours = list(filter(lambda ctr: cv.contourArea(ctr) > SYMBOL_MIN_AREA,
                             contours))
-        cv.drawContours(mask, contours, -1, (255, 255, 255), -1)
+        cv.drawContours(inner_mask, contours, -1, 255, -1)
 
         card.symbol_contours = contours
         card.warp_grey = blur
         card.warp_thresh = thresh
-        card.symbol_mask = mask
+        card.symbol_mask = cv.cvtColor(inner_mask, cv.COLOR_GRAY2BGR)
 
-        self.correct_white_balance(card)
+        self.correct_white_balance(card, inner_mask)
         # self.gain_colors(card, 2)
 
         #######################################################################
@@ -82,84 +141,81 @@ class CCardClassifier:
         # cv.putText(card.warp_white_balanced, (f"Number of symbols: {len(contours)}"),
         #     (5, 15), cv.FONT_HERSHEY_SIMPLEX, 0.5, (0,0.8,1), 1, cv.LINE_AA)
 
+        return inner_mask
+
     def gain_colors(self, card, factor):
         """ Gain colors by multiplying factor and saturation in HLS col-space """
         img_hls = cv.cvtColor(np.float32(card.warp_white_balanced), cv.COLOR_BGR2HLS)
         img_hls[:,:,2] *= factor
         card.warp_white_balanced = cv.cvtColor(np.float32(img_hls), cv.COLOR_HLS2BGR)
 
+    @profiling.timed("classify.number")
     def calc_number(self, card):
         """ Calculates number of symbols by analyzing num of symbol contours"""
         if len(card.symbol_contours) <= 3 and len(card.symbol_contours) > 0:
-            card.attributes["number"] = len(card.symbol_contours)
+            card.set_attribute("number", len(card.symbol_contours))
 
-    def calc_symbol(self, card):
+    @profiling.timed("classify.symbol")
+    def calc_symbol(self, card, inner_mask):
         """Determines symbol by comparing reference symbols"""
-        # Extract first symbol
-        x,y,w,h = cv.boundingRect(card.symbol_contours[0])
-        symbol_qcard = card.symbol_mask[y:y+h, x:x+w]
-        card.attributes["symbol"] = self.compare_symbol_reference(symbol_qcard)
+        # Extract first symbol or all symbols to vote
+        contours = card.symbol_contours if self.vote_symbols else card.symbol_contours[:1]
+        symbols_qcard = []
+        for contour in contours:
+            x,y,w,h = cv.boundingRect(contour)
+            if 50 <= h <= 80 and 120 <= w <= 160:
+                symbols_qcard.append(self.normalize_symbol(inner_mask[y:y+h, x:x+w]))
+        card.set_attribute("symbol", self.compare_symbol_reference(symbols_qcard))
+
+    @profiling.timed("classify.shading")
+    def calc_shading(self, card, features, debug=False):
+        """Determines shading by saturation and lightness of the symbol center"""
+        saturation_hsv = features.saturation
+        lightness_hls = features.lightness
+        if saturation_hsv > 0.5:
+            card.set_attribute("shading", "solid")
+        elif lightness_hls > 0.9 and saturation_hsv < 0.1:
+            card.set_attribute("shading", "empty")
+        else:
+            card.set_attribute("shading", "hatched")
 
-    def calc_shading(self, card):
-        img = card.warp_white_balanced
-        # Extract first symbol
-        x,y,w,h = cv.boundingRect(card.symbol_contours[0])
+        if not debug:
+            return
 
         card.warp_symbol_center_boxes = card.warp_white_balanced.copy()
 
-        # Pick only small part of symbol center
-        center_box = img[
-            int(y+0.4*h):int(y+0.6*h),
-            int(x+0.4*w):int(x+0.6*w)
-        ]
-
         # Draw small part of smbol into img
-        cv.rectangle(card.warp_symbol_center_boxes,
-            (int(x+0.4*w),int(y+0.4*h)),(int(x+0.6*w),int(y+0.6*h)),(0,0,0), 2)
-        cv.rectangle(card.warp_symbol_center_boxes,
-            (int(x+0.4*w),int(y+0.4*h)),(int(x+0.6*w),int(y+0.6*h)),(0,255,255), 1)
+        x0, y0, x1, y1 = features.center_box
+        cv.rectangle(card.warp_symbol_center_boxes, (x0, y0), (x1, y1), (0,0,0), 2)
+        cv.rectangle(card.warp_symbol_center_boxes, (x0, y0), (x1, y1), (0,255,255), 1)
 
-        center_box_hsv = cv.cvtColor(np.float32(center_box), cv.COLOR_BGR2HSV)
-        saturation_hsv = center_box_hsv[:, :, 1].mean()
         cv.putText(card.warp_symbol_center_boxes, f"Sat: {saturation_hsv:0.2f}", (5, 20), \
             cv.FONT_HERSHEY_SIMPLEX, 0.7, (255,0,0), 2)
-
-        center_box_hls = cv.cvtColor(np.float32(center_box), cv.COLOR_BGR2HLS)
-        lightness_hls = center_box_hls[:, :, 1].mean()
         cv.putText(card.warp_symbol_center_boxes, f"Lig: {lightness_hls:0.2f}", (5, 40), \
             cv.FONT_HERSHEY_SIMPLEX, 0.7, (255,0,0), 2)
-        if saturation_hsv > 0.5:
-            card.attributes["shading"] = "solid"
-        elif lightness_hls > 0.9 and saturation_hsv < 0.1:
-            card.attributes["shading"] = "empty"
-        else:
-            card.attributes["shading"] = "hatched"
-
         cv.putText(card.warp_symbol_center_boxes, card.get_shading(), (5, 60), \
             cv.FONT_HERSHEY_SIMPLEX, 0.7, (255,0,0), 2)
 
 
-    def calc_color(self, card):
-        # convert 3-channel to 1-channel
-        inner_mask, _, _ = cv.split(card.symbol_mask)
-        
-        # calc mean of each color channel inside the symbol contour
-        mean_b, mean_g, mean_r, _ = cv.mean(card.warp_white_balanced, mask=inner_mask)
+    @profiling.timed("classify.color")
+    def calc_color(self, card, features, debug=False):
+        """Determines color by the channel means inside the symbols"""
+        mean_b, mean_g, mean_r = features.symbol_means
         color_means = {
             "red" : mean_r,
             "green" : mean_g,
             "purple" : mean_b
         }
         max_color = max(color_means, key=color_means.get)
-        card.attributes["color"] = max_color
-
-        warp_hsv = cv.cvtColor(np.float32(card.warp_white_balanced),\
-             cv.COLOR_BGR2HSV)
+        card.set_attribute("color", max_color)
 
-        min_value = np.amin(warp_hsv[:, :, 2])
+        min_value = features.min_value
 
         if min_value < 0.1:
-            card.attributes["color"] = "purple"
+            card.set_attribute("color", "purple")
+
+        if not debug:
+            return
 
         card.warp_color_detection = card.warp_white_balanced.copy()
         cv.putText(card.warp_color_detection, f"Mean B: {mean_b:0.3f}", (5, 20), \
@@ -172,24 +228,26 @@ class CCardClassifier:
             cv.FONT_HERSHEY_SIMPLEX, 0.7, (255,0,0), 2)
 
 
-    def compare_symbol_reference(self, symbol_qcard):
-        """Compare symbol on card with reference symbol
+    @staticmethod
+    def normalize_symbol(symbol_mask):
+        """Returns a 1-channel symbol mask in SYMBOL_SIZE with values 0..1"""
+        resized = cv.resize(symbol_mask, SYMBOL_SIZE, interpolation=cv.INTER_AREA)
+        return np.float32(resized) / 255
+
+    def compare_symbol_reference(self, symbols_qcard):
+        """Compare normalized symbols of a card with all reference symbols,
+        every symbol votes for its most similar reference symbol
             return name of symbol or ''"""
-        similarity = {}
-        for symbol_name in self.symbol_reference:
-            symbol_size_h, symbol_size_w, _ = symbol_qcard.shape
-            if (
-                symbol_size_h < 50 or symbol_size_h > 80 
-                or symbol_size_w < 120 or symbol_size_w > 160
-            ):
-                return ""
-
-            symbol_ref = self.symbol_reference[symbol_name]
-            ref_h, ref_w, _ = symbol_ref.shape
-            symbol_qcard_resized = cv.resize(symbol_qcard, (ref_w, ref_h))
-
-            errorL2 = cv.norm(symbol_qcard_resized, symbol_ref, cv.NORM_L2)
-            similarity[symbol_name] = 1 - errorL2 / ( ref_h * ref_w )
-        return max(similarity, key=similarity.get)
+        if len(symbols_qcard) == 0:
+            return ""
+
+        # similarity of every symbol (rows) to every reference symbol (columns)
+        similarity = 1 - np.abs(
+            np.stack(symbols_qcard)[:, np.newaxis] - self.symbol_reference).mean(axis=(2, 3))
+        votes = np.bincount(similarity.argmax(axis=1), minlength=len(self.symbol_names))
+        total = similarity.sum(axis=0)
+        # most votes, ties broken by the summed similarity
+        best = max(range(len(self.symbol_names)), key=lambda i: (votes[i], total[i]))
+        return self.symbol_names[best]
 
         
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""Module with a small learned card classifier running on the CPU
+
+The network gets a downscaled, white balanced version of the flattened
+card image (CQueryCard.get_warp(WARP_SIZE)) and scores the three values of every
+attribute. It is a small fully connected network in NumPy, trained on
+cards labelled by the CCardClassifier, run this module to train it.
+"""
+import glob
+import numpy as np
+import cv2 as cv
+import set_engine as se
+
+MODEL_PATH = "card_cnn_model.npz"
+TRAIN_IMG_PATHS = "Imgs/2022-*.png"
+
+INPUT_W = 20
+INPUT_H = 30
+NUM_OF_VALUES = 3
+# flattened card img size used as input, smaller than the 200x300 warp of
+# the CCardClassifier, so the network needs no full resolution warp
+WARP_SIZE = (2 * INPUT_W, 2 * INPUT_H)
+
+
+def card_features(warp):
+    """Returns the feature vector of a flattened card image of any size"""
+    small = cv.resize(warp, (INPUT_W, INPUT_H), interpolation=cv.INTER_AREA)
+    small = np.float32(small)
+    # white balance: the brightest pixels of the card are white in reality
+    white = np.percentile(small.reshape(-1, 3), 95, axis=0) + 1
+    return np.clip(small / white, 0, 1).ravel()
+
+
+class CCardCnn:
+    """Small neural network scoring the attributes of flattened card images"""
+    def __init__(self, weights=None, hidden=64, seed=0):
+        num_of_inputs = INPUT_W * INPUT_H * 3
+        num_of_outputs = len(se.ATTRIBUTE_KEYS) * NUM_OF_VALUES
+        if weights is None:
+            rng = np.random.default_rng(seed)
+            weights = {
+                "w1": rng.normal(0, np.sqrt(2 / num_of_inputs),
+                                 (num_of_inputs, hidden)).astype(np.float32),
+                "b1": np.zeros(hidden, np.float32),
+                "w2": rng.normal(0, np.sqrt(1 / hidden),
+                                 (hidden, num_of_outputs)).astype(np.float32),
+                "b2": np.zeros(num_of_outputs, np.float32),
+                "mean": np.zeros(num_of_inputs, np.float32),
+            }
+        self.weights = weights
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        """Load model weights from a .npz file"""
+        with np.load(path) as data:
+            return cls(weights={key: data[key] for key in data.files})
+
+    def save(self, path=MODEL_PATH):
+        """Save model weights to a .npz file"""
+        np.savez_compressed(path, **self.weights)
+
+    def __forward(self, features):
+        """Returns hidden activations and scores (n x 4 x 3)"""
+        hidden = np.maximum(
+            (features - self.weights["mean"]) @ self.weights["w1"] + self.weights["b1"], 0)
+        scores = hidden @ self.weights["w2"] + self.weights["b2"]
+        return hidden, scores.reshape(len(features), len(se.ATTRIBUTE_KEYS), NUM_OF_VALUES)
+
+    def predict_proba(self, warps):
+        """Returns the probability of every attribute value (n x 4 x 3)"""
+        if len(warps) == 0:
+            return np.zeros((0, len(se.ATTRIBUTE_KEYS), NUM_OF_VALUES), np.float32)
+        _, scores = self.__forward(np.array([card_features(warp) for warp in warps]))
+        scores = np.exp(scores - scores.max(axis=2, keepdims=True))
+        return scores / scores.sum(axis=2, keepdims=True)
+
+    def predict_ids(self, warps):
+        """Returns the most likely card id (0..80) of every card image"""
+        digits = self.predict_proba(warps).argmax(axis=2)
+        return digits @ (NUM_OF_VALUES ** np.arange(len(se.ATTRIBUTE_KEYS)))
+
+    def fit(self, warps, card_ids, epochs=300, learning_rate=0.05, weight_decay=1e-4):
+        """Train the network with full batch gradient descent,
+        returns the training accuracy of whole cards"""
+        features = np.array([card_features(warp) for warp in warps])
+        targets = se.codes_to_array(np.asarray(card_ids))
+        self.weights["mean"] = features.mean(axis=0)
+        rows = np.arange(len(features))[:, np.newaxis]
+        cols = np.arange(len(se.ATTRIBUTE_KEYS))[np.newaxis, :]
+
+        for _ in range(epochs):
+            hidden, scores = self.__forward(features)
+            probs = np.exp(scores - scores.max(axis=2, keepdims=True))
+            probs /= probs.sum(axis=2, keepdims=True)
+
+            # gradient of the summed cross entropy of all attributes
+            grad_scores = probs
+            grad_scores[rows, cols, targets] -= 1
+            grad_scores = grad_scores.reshape(len(features), -1) / len(features)
+
+            grad_hidden = (grad_scores @ self.weights["w2"].T) * (hidden > 0)
+            gradients = {
+                "w2": hidden.T @ grad_scores + weight_decay * self.weights["w2"],
+                "b2": grad_scores.sum(axis=0),
+                "w1": (features - self.weights["mean"]).T @ grad_hidden
+                      + weight_decay * self.weights["w1"],
+                "b1": grad_hidden.sum(axis=0),
+            }
+            for key, gradient in gradients.items():
+                self.weights[key] -= learning_rate * gradient.astype(np.float32)
+
+        return float(np.mean(self.predict_ids(warps) == np.asarray(card_ids)))
+
+
+_model = None
+
+
+def get_model():
+    """Returns the default model, loaded once from MODEL_PATH"""
+    global _model  # pylint: disable=global-statement
+    if _model is None:
+        try:
+            _model = CCardCnn.load(MODEL_PATH)
+        except FileNotFoundError as error:
+            raise FileNotFoundError(
+                f"No card_cnn model at {MODEL_PATH}, train it with 'python card_cnn.py'"
+            ) from error
+    return _model
+
+
+def collect_training_data(img_paths):
+    """Returns card images and card ids labelled by the CCardClassifier"""
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CCardDetector
+    card_detector = CCardDetector()
+    warps = []
+    card_ids = []
+    for img_path in img_paths:
+        for card in card_detector.get_cards_from_img(cv.imread(img_path)):
+            warps.append(card.get_warp(WARP_SIZE))
+            card_ids.append(card.get_id())
+    return warps, card_ids
+
+
+if __name__ == '__main__':
+    Warps, CardIds = collect_training_data(sorted(glob.glob(TRAIN_IMG_PATHS)))
+    Model = CCardCnn()
+    print(f"Training with {len(Warps)} cards")
+    print(f"Training accuracy: {Model.fit(Warps, CardIds):0.3f}")
+    Model.save(MODEL_PATH)
+    print(f"Saved model to {MODEL_PATH}")
@@ -1,18 +1,44 @@
 """Module to detect cards in image"""
+import time
+from collections import deque
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from threading import Lock
 import numpy as np
 import cv2 as cv
+import profiling
 import set_engine
 from card_classifier import CCardClassifier
 
 
+FLATTEN_WIDTH = 200
+FLATTEN_HEIGHT = 300
+APPEARANCE_SIZE = (16, 24)  # width, height of the thumbnail to compare the look of cards
+
+
 class CQueryCard(set_engine.CCard):
-    """Structure to store information about query cards in the camera img_raw."""
+    """Structure to store information about query cards in the camera img_raw.
+    Unlike CCard the attributes are mutable and set by the CCardClassifier,
+    the per-detection image data lives in the instance __dict__."""
+
+    # Images and contours calculated by the CCardClassifier,
+    # only kept in debug mode, see get_img
+    CLASSIFIER_OUTPUTS = (
+        "warp_grey", "warp_thresh", "symbol_contours", "symbol_mask",
+        "warp_white_balanced", "warp_symbol_center_boxes", "warp_color_detection")
+
+    # the attributes change when the card is classified, so unlike CCard
+    # a query card must not be used in sets or as dict key
+    __hash__ = None
+
+    def __new__(cls, *args, **kwargs):
+        """Every query card is a new card with unset attributes"""
+        # pylint: disable=unused-argument
+        return super().__new__(cls)
 
-    def __init__(self, contour, raw, pts):
-        """Uses contour to create a qCard"""
-        # Init parent class from set_engine
-        super().__init__()
+    def __init__(self, contour, raw, pts, buffer_pool=None):
+        """Uses contour to create a qCard, the flattened img of the card
+        is only calculated when it is used the first time"""
 
         self.contour = contour  # Contour of card
         self.area = cv.contourArea(contour)  # Area size of card
@@ -25,7 +51,102 @@ class CQueryCard(set_engine.CCard):
         cent_y = int(average[0][1])
         self.center = [cent_x, cent_y]
 
-        self.warp = self.flattener(raw, pts, self.width, self.height)
+        self.raw = raw  # img_raw the card is flattened from, dropped after flattening
+        self.buffer_pool = buffer_pool  # optional CWarpBufferPool for the warp
+        self.transform = None  # perspective transform to the 200x300 warp
+        self._warp = None
+        self.small_warps = {}  # flattened imgs of other sizes by (width, height)
+        self.appearance = None  # thumbnail of get_appearance
+        self.init_images()
+
+    @classmethod
+    def from_warp(cls, warp):
+        """Create a qCard of a flattened card image only, without contour"""
+        card = cls.__new__(cls)
+        card.contour = None
+        card.area = 0
+        card.width = 0
+        card.height = 0
+        card.corner_pts = None
+        card.center = [0, 0]
+        card.raw = None
+        card.buffer_pool = None
+        card.transform = None
+        card.small_warps = {}
+        card.appearance = None
+        card.warp = warp
+        card.init_images()
+        return card
+
+    @classmethod
+    def from_record(cls, record):
+        """Create a qCard of a shared_frames.CARD_RECORD, without images"""
+        card = cls.from_warp(None)
+        card.corner_pts = np.float32(record["corners"]).reshape(4, 1, 2)
+        card.contour = np.int32(np.round(card.corner_pts))
+        card.area = cv.contourArea(card.contour)
+        card.center = [int(value) for value in record["center"]]
+        if record["card_id"] >= 0:
+            card.set_card(set_engine.decode_card(int(record["card_id"])))
+        return card
+
+    @property
+    def warp(self):
+        """200x300 flattened img of the card, warped on first use,
+        None if the card can not be flattened"""
+        if self._warp is None and self.raw is not None:
+            dst = None if self.buffer_pool is None else self.buffer_pool.acquire(self)
+            with profiling.timer("warp"):
+                self._warp = self.flattener(self.raw, (FLATTEN_WIDTH, FLATTEN_HEIGHT), dst)
+            self.raw = None
+        return self._warp
+
+    @warp.setter
+    def warp(self, warp):
+        self._warp = warp
+
+    def get_warp(self, size_wh):
+        """Returns the flattened img of the card in the given size,
+        warped directly from img_raw if the 200x300 warp was not needed yet"""
+        if size_wh == (FLATTEN_WIDTH, FLATTEN_HEIGHT):
+            return self.warp
+        if size_wh not in self.small_warps:
+            if self.raw is not None:
+                with profiling.timer("warp"):
+                    warp = self.flattener(self.raw, size_wh)
+            elif self._warp is not None:
+                warp = cv.resize(self._warp, size_wh, interpolation=cv.INTER_AREA)
+            else:
+                warp = None
+            self.small_warps[size_wh] = warp
+        return self.small_warps[size_wh]
+
+    def get_appearance(self):
+        """Returns a small float32 thumbnail of the card region of the
+        img_raw to compare the look of cards, None without img_raw"""
+        if self.appearance is None and self.raw is not None and self.contour is not None:
+            x, y, w, h = cv.boundingRect(self.contour)
+            self.appearance = np.float32(cv.resize(
+                self.raw[y:y+h, x:x+w], APPEARANCE_SIZE, interpolation=cv.INTER_AREA))
+        return self.appearance
+
+    def release_warp(self):
+        """Drop the flattened imgs, returns the buffer of the warp or None"""
+        warp = self._warp
+        self._warp = None
+        self.raw = None
+        self.small_warps = {}
+        return warp
+
+    def init_images(self):
+        """Init the images and contours calculated by the CCardClassifier"""
+        self.clear_images()
+        self.classifier = None # CCardClassifier of the last classification
+        self.track_id = None # id of the card in the CCardTracker
+        self.classified_from = None # qcard of a previous frame the classification is taken from
+
+    def clear_images(self):
+        """Drop the images and contours calculated by the CCardClassifier"""
         self.warp_grey = [] # 200x300, flattened grey img of card
         self.warp_thresh = [] # 200x300, flattened thresholded img of card
         self.symbol_contours = [] # list of contours of the card symbols
@@ -34,10 +155,71 @@ class CQueryCard(set_engine.CCard):
         self.warp_symbol_center_boxes = []
         self.warp_color_detection = []
 
-    def flattener(self, raw, pts, width, height):
-        """Flattens an img_raw of a card into a top-down 200x300 perspective."""
-        FLATTEN_WIDTH = 200
-        FLATTEN_HEIGHT = 300
+    def copy_classification(self, other):
+        """Take over attributes and classifier images of the given qcard"""
+        self.set_card(other)
+        for name in self.CLASSIFIER_OUTPUTS:
+            setattr(self, name, getattr(other, name))
+        self.classifier = other.classifier
+        self.classified_from = other
+
+    def get_img(self, name):
+        """Returns the img attribute name of the card, images of the
+        CCardClassifier are calculated on demand if they were not kept"""
+        img = getattr(self, name)
+        if (
+            name in self.CLASSIFIER_OUTPUTS and len(img) == 0
+            and self.classifier is not None and self.warp is not None
+        ):
+            self.classifier.calc_debug_images(self)
+            img = getattr(self, name)
+        return img
+
+    def copy_transform(self, other):
+        """Take over the perspective transform of the given qcard,
+        only valid if the corners did not move"""
+        self.transform = other.get_transform()
+
+    def set_attribute(self, key, value):
+        """Set one attribute of the card, key as in set_engine.ATTRIBUTE_KEYS"""
+        values = list(self._values)
+        values[set_engine.ATTRIBUTE_KEYS.index(key)] = value
+        self._card_id = set_engine.values_to_id(values)
+        self._values = tuple(values)
+
+    def set_card(self, card):
+        """Set all attributes to the ones of the given set_engine.CCard"""
+        # pylint: disable=protected-access
+        self._values = card._values
+        self._card_id = card._card_id
+
+    def get_card(self):
+        """Returns the interned set_engine.CCard with the attributes of the card"""
+        return set_engine.CCard(*self._values)
+
+    def get_transform(self):
+        """Returns the perspective transform of the corner points
+        to the 200x300 top-down view, None if the corners can not be ordered"""
+        if self.transform is None and self.corner_pts is not None:
+            self.transform = self.calc_transform(self.corner_pts, self.width, self.height)
+        return self.transform
+
+    def flattener(self, raw, size_wh=(FLATTEN_WIDTH, FLATTEN_HEIGHT), dst=None):
+        """Flattens an img_raw of a card into a top-down perspective
+        of size_wh, 200x300 by default. dst is an optional output buffer."""
+        transform_m = self.get_transform()
+        if transform_m is None:
+            return None
+        if size_wh != (FLATTEN_WIDTH, FLATTEN_HEIGHT):
+            scale = np.diag([(size_wh[0] - 1) / (FLATTEN_WIDTH - 1),
+                             (size_wh[1] - 1) / (FLATTEN_HEIGHT - 1), 1])
+            transform_m = scale @ transform_m
+        return cv.warpPerspective(raw, transform_m, size_wh, dst=dst)
+
+    @staticmethod
+    def calc_transform(pts, width, height):
+        """Returns the transform matrix of the corner points pts of a card
+        with bounding box width x height to the 200x300 top-down view."""
         # print("Pts: ", pts)
         temp_rect = np.zeros((4, 2), dtype="float32")
 
@@ -91,54 +273,272 @@ class CQueryCard(set_engine.CCard):
         else:
             return None
 
-        # create transform matrix and warp card image
+        # create transform matrix
         dst = np.array([[0, 0], [FLATTEN_WIDTH-1, 0], [FLATTEN_WIDTH-1, FLATTEN_HEIGHT-1],
                     [0, FLATTEN_HEIGHT-1]], np.float32)
-        transform_m = cv.getPerspectiveTransform(temp_rect, dst)
-        warp = cv.warpPerspective(raw, transform_m, (FLATTEN_WIDTH, FLATTEN_HEIGHT))
+        return cv.getPerspectiveTransform(temp_rect, dst)
+
+
+class CWarpBufferPool:
+    """Preallocated output buffers for the 200x300 flattened card imgs.
+    The buffers of a detection are reused after keep_frames further
+    detections, the warp of older cards is None then."""
+    def __init__(self, num_of_buffers=32, keep_frames=3):
+        self.free = [
+            np.empty((FLATTEN_HEIGHT, FLATTEN_WIDTH, 3), np.uint8) for _ in range(num_of_buffers)]
+        self.keep_frames = keep_frames
+        self.frames = deque() # qcards holding a buffer, one list per detection
+        self.lock = Lock() # warps are calculated lazily, also in classification threads
+
+        self.acquired = 0
+        self.allocated = 0 # buffers allocated because the pool was empty
+
+    def next_frame(self):
+        """Start a new detection, release the buffers of the oldest one"""
+        with self.lock:
+            self.frames.append([])
+            while len(self.frames) > self.keep_frames + 1:
+                for qcard in self.frames.popleft():
+                    warp = qcard.release_warp()
+                    if warp is not None:
+                        self.free.append(warp)
+
+    def acquire(self, qcard):
+        """Returns a free buffer for the warp of qcard"""
+        with self.lock:
+            if not self.frames:
+                self.frames.append([])
+            self.frames[-1].append(qcard)
+            self.acquired += 1
+            if self.free:
+                return self.free.pop()
+            self.allocated += 1
+            return np.empty((FLATTEN_HEIGHT, FLATTEN_WIDTH, 3), np.uint8)
+
+
+class CSceneChangeGate:
+    """Class to detect if the game field changed since the last full pass
+    by comparing downscaled grey images"""
+    def __init__(self, size_wh=(160, 90), pixel_threshold=15, changed_fraction=0.002,
+                 max_skipped_frames=30):
+        """A frame counts as changed if more than changed_fraction of the
+        downscaled pixels differ by more than pixel_threshold grey values
+        from the frame of the last full pass, after max_skipped_frames
+        unchanged frames a full pass is forced anyway"""
+        self.size_wh = size_wh
+        self.pixel_threshold = pixel_threshold
+        self.changed_fraction = changed_fraction
+        self.max_skipped_frames = max_skipped_frames
+
+        self.reference = None # downscaled grey img of the last full pass
+        self.skipped_frames = 0
+        # is_changed and invalidate may be called from different threads
+        # of the frame_pipeline
+        self.lock = Lock()
+
+        self.frames = 0
+        self.hits = 0 # frames detected as unchanged
+        self.gate_time = 0.0
+
+    @profiling.timed("gate")
+    def is_changed(self, raw):
+        """Returns True if a full detection pass is needed for raw,
+        the frame is the new reference then"""
+        start = time.perf_counter()
+        small = cv.cvtColor(cv.resize(raw, self.size_wh, interpolation=cv.INTER_AREA),
+                            cv.COLOR_BGR2GRAY)
+        with self.lock:
+            changed = (
+                self.reference is None
+                or self.skipped_frames >= self.max_skipped_frames
+                or np.count_nonzero(cv.absdiff(small, self.reference) > self.pixel_threshold)
+                > self.changed_fraction * small.size
+            )
+            if changed:
+                self.reference = small
+                self.skipped_frames = 0
+            else:
+                self.skipped_frames += 1
+                self.hits += 1
+            self.frames += 1
+        self.gate_time += time.perf_counter() - start
+        return changed
 
-        return warp
+    def invalidate(self):
+        """Force a full detection pass for the next frame"""
+        with self.lock:
+            self.reference = None
+
+    def get_report(self):
+        """Returns dict with hit rate and mean time of the gate"""
+        return {
+            "frames": self.frames,
+            "hit_rate": self.hits / max(self.frames, 1),
+            "ms_per_frame": self.gate_time / max(self.frames, 1) * 1e3,
+        }
+
+
+_worker_classifier = None
+
+
+def _init_classification_worker(vote_symbols):
+    """Create the CCardClassifier of a classification worker process"""
+    global _worker_classifier  # pylint: disable=global-statement
+    _worker_classifier = CCardClassifier(vote_symbols=vote_symbols)
+
+
+def _classify_warp(warp):
+    """Classify a flattened card image in a worker process,
+    returns only the compact set_engine.CCard instead of all images"""
+    return _worker_classifier.determine_attributes(CQueryCard.from_warp(warp)).get_card()
 
 
 class CCardDetector:
     """Class to detect cards on game field"""
-    def __init__(self):
-        
+    def __init__(self, workers=0, use_processes=False, tracker=None, gate=None,
+                 detection_scale=1.0, warp_buffers=0, debug_images=False,
+                 vote_symbols=False):
+        """vote_symbols determines the symbol by all symbols of a card
+        instead of the first one, see CCardClassifier
+        debug_images keeps all images of the CCardClassifier in the
+        cards, otherwise they are calculated on demand by CQueryCard.get_img
+        warp_buffers > 0 flattens the cards into a CWarpBufferPool of
+        preallocated buffers, the warps of a detection stay valid for the
+        next three detections, so the cards must be classified before, the
+        CFramePipeline refuses it
+        detection_scale < 1 searches the card contours in a downscaled
+        img_raw, the cards are still flattened from the full resolution
+        gate is an optional CSceneChangeGate, the last cards are returned
+        again without detection as long as the game field does not change
+        tracker is an optional card_tracking.CCardTracker to only classify
+        new or moved cards and vote for their attributes over frames
+        workers > 0 classifies the cards in parallel,
+        by default in a thread pool (OpenCV releases the GIL), with
+        use_processes in a process pool which only sends the attributes
+        back"""
 
         self.CARD_MAX_AREA = 120000
         self.CARD_MIN_AREA = 10000
 
         self.raw = [] # raw image of game field
         self.thresh = [] # thresholded img of game field
+        self.grey = [] # full resolution grey img of game field
+        self.thresh_val = 0 # Otsu threshold of the last frame, reused to refine the contours
 
-        self.CardClassifier = CCardClassifier()
+        self.CardClassifier = CCardClassifier(debug_images, vote_symbols)
 
+        self.detection_scale = detection_scale
+        self.buffer_pool = CWarpBufferPool(warp_buffers) if warp_buffers > 0 else None
+
+        self.workers = workers
+        self.use_processes = use_processes
+        self.pool = None # created on first use and kept until close()
+
+        self.tracker = tracker
+        self.gate = gate
+        self.last_cards = [] # result of the last full pass
+
+    @profiling.timed("get_cards")
     def get_cards_from_img(self, raw):
         """Main Function of Module"""
+        if self.scene_unchanged(raw):
+            return self.get_last_cards()
+
+        qcards = self.detect_cards(raw)
+
+        return self.classify_detected_cards(qcards)
+
+    def get_last_cards(self):
+        """Returns the cards of the last full pass for an unchanged frame"""
+        if self.tracker is not None:
+            self.tracker.skip_frame()
+        return self.last_cards
+
+    def scene_unchanged(self, raw):
+        """Returns True if the gate detects no change of the game field,
+        the last cards can be used then"""
+        return self.gate is not None and not self.gate.is_changed(raw)
+
+    @profiling.timed("classify")
+    def classify_detected_cards(self, qcards):
+        """Classify the qcards of detect_cards, returns the correct ones"""
+        if self.tracker is None:
+            qcards = self.classify_cards(qcards)
+        else:
+            self.classify_cards(self.tracker.match(qcards))
+            self.tracker.update(qcards)
+            if self.gate is not None and not self.tracker.is_settled():
+                # the cards of a static game field still need votes
+                self.gate.invalidate()
+
+        self.last_cards = list(filter(self.card_is_correct, qcards))
+        return self.last_cards
+
+    @profiling.timed("detect")
+    def detect_cards(self, raw):
+        """Returns the query cards of the img_raw, not yet classified"""
         self.raw = raw
+        if self.buffer_pool is not None:
+            self.buffer_pool.next_frame()
         # Pre-process raw image of game field
-        _, _, self.thresh = self.__preprocess_img_raw(raw)
+        _, _, thresh = self.__preprocess_img_raw(raw)
+        self.thresh = thresh
 
         # Find the contours of all cards in the img_raw (query cards)
-        qcards = self.__find_cards(self.thresh, raw)
-        
-        qcards = list(map(self.CardClassifier.determine_attributes, qcards))
+        return self.__find_cards(thresh, raw)
+
+    def classify_cards(self, qcards):
+        """Determine attributes of all given qcards, serial or in the pool"""
+        if self.workers <= 0 or len(qcards) <= 1:
+            return list(map(self.CardClassifier.determine_attributes, qcards))
+
+        if self.pool is None:
+            if self.use_processes:
+                self.pool = Pool(self.workers, initializer=_init_classification_worker,
+                                 initargs=(self.CardClassifier.vote_symbols,))
+            else:
+                self.pool = ThreadPool(self.workers)
+
+        if not self.use_processes:
+            return self.pool.map(self.CardClassifier.determine_attributes, qcards)
+
+        classified = [qcard for qcard in qcards if qcard.warp is not None]
+        for qcard, card in zip(
+                classified, self.pool.map(_classify_warp, [qcard.warp for qcard in classified])):
+            qcard.set_card(card)
+            qcard.classifier = self.CardClassifier
+        return qcards
 
-        return list(filter(self.card_is_correct, qcards))
+    def close(self):
+        """Stop the worker pool"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
 
     def card_is_correct(self, card):
-        for attribute in card.attributes.values():
-            if attribute == "":
-                return False
-        return True
+        """Returns True if all attributes of the card were determined"""
+        return card.get_id() is not None
 
+    @profiling.timed("detect.threshold")
     def __preprocess_img_raw(self, raw):
-        """Returns a grayed, img_blurred and thresholded img """
+        """Returns a grayed, img_blurred and thresholded img,
+        downscaled by detection_scale"""
 
         grey = cv.cvtColor(raw, cv.COLOR_BGR2GRAY)
+        self.grey = grey # full resolution, the card contours are refined in it
+        if self.detection_scale != 1:
+            # INTER_AREA is only fast for integer factors like 1/2,
+            # other factors are several times slower than INTER_LINEAR
+            factor = 1 / self.detection_scale
+            interpolation = (
+                cv.INTER_AREA if abs(factor - round(factor)) < 1e-6 else cv.INTER_LINEAR)
+            grey = cv.resize(grey, None, fx=self.detection_scale, fy=self.detection_scale,
+                             interpolation=interpolation)
         blur = cv.GaussianBlur(grey, (3, 3), 0)
 
         thresh_val, thresh = cv.threshold(blur, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+        self.thresh_val = thresh_val
 
         # Detect edges using Canny
         # thresh = cv.Canny(thresh, thresh_val, thresh_val * 2)
@@ -150,55 +550,73 @@ class CCardDetector:
         return grey, blur, thresh
 
 
+    @profiling.timed("detect.contours")
     def __find_cards(self, thresh, raw):
         """Finds all card-sized contours"""
 
-        # Find contours and sort their indices by contour size
-        cnts, hier = cv.findContours(thresh, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-        index_sort = sorted(
-            range(len(cnts)), key=lambda i: cv.contourArea(cnts[i]), reverse=True
-            )
+        # Cards have no parents, so only the outer contours are needed
+        cnts, _ = cv.findContours(thresh, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
 
-        # If there are no contours, do nothing
-        if len(cnts) == 0:
-            return [], []
-
-        # Otherwise, initialize empty sorted contour and hierarchy lists
-        cnts_sort = []
-        hier_sort = []
-
-        # Fill empty lists with sorted contour and sorted hierarchy. Now,
-        # the indices of the contour list still correspond with those of
-        # the hierarchy list. The hierarchy array can be used to check if
-        # the contours have parents or not.
-        for i in index_sort:
-            cnts_sort.append(cnts[i])
-            hier_sort.append(hier[0][i])
+        # Keep only contours of card size, then sort them by size,
+        # area of the downscaled contours is smaller by detection_scale²
+        scale_area = self.detection_scale ** 2
+        sizes = {}
+        for i, ctr in enumerate(cnts):
+            size = cv.contourArea(ctr) / scale_area
+            if self.CARD_MIN_AREA < size < self.CARD_MAX_AREA:
+                sizes[i] = size
+        index_sort = sorted(sizes, key=sizes.get, reverse=True)
 
         qcards = []
-        for i, ctr in enumerate(cnts_sort):
-            size = cv.contourArea(ctr)
+        for i in index_sort:
+            ctr = cnts[i]
             peri = cv.arcLength(ctr, True)
             approx = cv.approxPolyDP(ctr, 0.1*peri, True)
 
             # Determine which of the contours are cards by applying the
             # following criteria:
-            # 1) Smaller area than the maximum card size
-            # 2) bigger area than the minimum card size
-            # 3) have no parents
+            # 1) Smaller area than the maximum card size (see above)
+            # 2) bigger area than the minimum card size (see above)
+            # 3) have no parents (RETR_EXTERNAL)
             # 4) have four corners
 
-            if (
-                (size < self.CARD_MAX_AREA) and
-                (size > self.CARD_MIN_AREA) and
-                hier_sort[i][3] == -1 and
-                len(approx) == 4
-            ):
+            if len(approx) == 4:
+                if self.detection_scale != 1:
+                    # back to the full resolution raw
+                    ctr, approx = self.__refine_card_contour(raw, ctr)
+                    if ctr is None:
+                        continue
                 # Create a card object from the contour and append it to
                 # the list of cards. preprocess_card function takes the
                 # card contour and contour and determines the cards
-                # properties (corner points, etc). It generates a
-                # flattened raw of the card
-                qcards.append(CQueryCard(ctr, raw, np.float32(approx)))
+                # properties (corner points, etc). The flattened raw of
+                # the card is generated when it is classified
+                qcards.append(CQueryCard(ctr, raw, np.float32(approx), self.buffer_pool))
 
         return qcards
+
+    def __refine_card_contour(self, raw, ctr_small):
+        """Find the contour of a card found in the downscaled thresh again
+        in its region of the full resolution grey img, so the corners are as
+        exact as without downscaling.
+        Returns contour and corner points or None, None"""
+        x, y, w, h = cv.boundingRect(ctr_small)
+        margin = 4
+        x0 = max(int((x - margin) / self.detection_scale), 0)
+        y0 = max(int((y - margin) / self.detection_scale), 0)
+        x1 = min(int((x + w + margin) / self.detection_scale), raw.shape[1])
+        y1 = min(int((y + h + margin) / self.detection_scale), raw.shape[0])
+
+        blur = cv.GaussianBlur(self.grey[y0:y1, x0:x1], (3, 3), 0)
+        _, thresh = cv.threshold(blur, self.thresh_val, 255, cv.THRESH_BINARY)
+        cnts, _ = cv.findContours(thresh, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE,
+                                  offset=(x0, y0))
+        if len(cnts) == 0:
+            return None, None
+
+        ctr = max(cnts, key=cv.contourArea)
+        peri = cv.arcLength(ctr, True)
+        approx = cv.approxPolyDP(ctr, 0.1*peri, True)
+        if len(approx) != 4:
+            return None, None
+        return ctr, approx
@@ -0,0 +1,225 @@
+"""Module to track cards over frames
+
+Cards are associated with the cards of the previous frames by their
+center points and areas. Cards which did not move and still look the same
+keep the attributes of their last classification, so only new, moved or
+replaced cards are classified, cards with unmoved corners reuse the
+perspective transform of the last one.
+The attributes of a card are the majority vote of its last
+classifications, cards without a certain vote are not reported.
+"""
+from collections import Counter, deque
+import numpy as np
+import set_engine
+
+MAX_MATCH_DIST = 80  # max center distance in px of the same card in two frames
+MAX_STILL_DIST = 8  # max center distance in px of a card which did not move
+MAX_STILL_AREA_CHANGE = 0.1  # max relative area change of a card which did not move
+MAX_CORNER_DIST = 1.0  # max corner movement in px to reuse the perspective transform
+MAX_APPEARANCE_DIFF = 5.0  # max mean BGR difference of the thumbnail of a card not replaced
+MAX_MISSING_FRAMES = 5  # frames a card may be missing before its track is removed
+RECLASSIFY_INTERVAL = 30  # classify still cards again after this number of frames,
+# frames skipped by a scene change gate included
+VOTE_WINDOW = 3  # number of last classifications of a card used for voting
+VOTE_THRESHOLD = 2  # min votes for an attribute value to be certain
+
+
+def corners_unmoved(qcard, other):
+    """Returns True if the corner points of both qcards are the same
+    within MAX_CORNER_DIST"""
+    if qcard.corner_pts is None or other.corner_pts is None:
+        return False
+    return (
+        qcard.corner_pts.shape == other.corner_pts.shape
+        and np.abs(qcard.corner_pts - other.corner_pts).max() <= MAX_CORNER_DIST
+    )
+
+
+def looks_same(qcard, appearance):
+    """Returns True if the thumbnail of the qcard (CQueryCard.get_appearance)
+    is the given appearance within MAX_APPEARANCE_DIFF"""
+    current = qcard.get_appearance()
+    if current is None or appearance is None:
+        return False
+    return float(np.abs(current - appearance).mean()) <= MAX_APPEARANCE_DIFF
+
+
+class CTrack:
+    """Structure to store one tracked card"""
+    def __init__(self, track_id, qcard, vote_window):
+        self.track_id = track_id
+        self.qcard = qcard  # CQueryCard of the last classification
+        self.center = qcard.center  # center of the last frame
+        self.area = qcard.area
+        self.appearance = qcard.get_appearance()  # thumbnail of the last classification
+        self.missing_frames = 0
+        self.frames_since_classification = 0
+        self.history = deque(maxlen=vote_window)  # attribute values of last classifications
+        self.voted_card = None  # set_engine.CCard of the vote or None if not certain
+
+    def vote(self, vote_threshold):
+        """Majority vote of every attribute over the history,
+        sets voted_card to None if one attribute is not certain"""
+        values = []
+        for attribute_values in zip(*self.history):
+            value, votes = Counter(attribute_values).most_common(1)[0]
+            if votes < vote_threshold or value == "":
+                self.voted_card = None
+                return
+            values.append(value)
+        self.voted_card = set_engine.CCard(*values)
+
+
+class CCardTracker:
+    """Class to associate query cards between frames"""
+    def __init__(self, max_match_dist=MAX_MATCH_DIST, max_still_dist=MAX_STILL_DIST,
+                 max_missing_frames=MAX_MISSING_FRAMES, reclassify_interval=RECLASSIFY_INTERVAL,
+                 vote_window=VOTE_WINDOW, vote_threshold=VOTE_THRESHOLD):
+        if not 0 < vote_threshold <= vote_window:
+            raise ValueError("vote_threshold has to be in 1..vote_window")
+        self.max_match_dist = max_match_dist
+        self.max_still_dist = max_still_dist
+        self.max_missing_frames = max_missing_frames
+        self.reclassify_interval = reclassify_interval
+        self.vote_window = vote_window
+        self.vote_threshold = vote_threshold
+
+        self.tracks = []
+        self.next_track_id = 0
+
+        self.reused = 0  # number of cards which were not classified again
+        self.classified = 0
+
+    def match(self, qcards):
+        """Associate the qcards of a new frame with the tracks
+
+        Sets qcard.track_id (None for new cards) and takes over the
+        classification of cards which did not move and have a certain vote.
+        Returns the list of qcards which have to be classified."""
+        pairs = []
+        for i, qcard in enumerate(qcards):
+            qcard.track_id = None
+            # before classification drops the img_raw of the card
+            qcard.get_appearance()
+            for j, track in enumerate(self.tracks):
+                dist = np.hypot(qcard.center[0] - track.center[0],
+                                qcard.center[1] - track.center[1])
+                if dist < self.max_match_dist:
+                    pairs.append((dist, i, j))
+
+        # greedy assignment, closest pairs first
+        matched_tracks = set()
+        to_classify = set(range(len(qcards)))
+        for dist, i, j in sorted(pairs):
+            if qcards[i].track_id is not None or j in matched_tracks:
+                continue
+            track = self.tracks[j]
+            qcard = qcards[i]
+            qcard.track_id = track.track_id
+            matched_tracks.add(j)
+
+            still = (
+                dist <= self.max_still_dist
+                and abs(qcard.area - track.area) <= MAX_STILL_AREA_CHANGE * track.area
+            )
+            if still and corners_unmoved(qcard, track.qcard):
+                qcard.copy_transform(track.qcard)
+
+            if (
+                not still
+                or track.missing_frames > 0
+                or not looks_same(qcard, track.appearance)
+            ):
+                # card may have been replaced by another one at the same place
+                track.history.clear()
+                track.voted_card = None
+
+            if (
+                still
+                and track.voted_card is not None
+                and track.frames_since_classification < self.reclassify_interval
+            ):
+                qcard.copy_classification(track.qcard)
+                to_classify.discard(i)
+
+        self.reused += len(qcards) - len(to_classify)
+        self.classified += len(to_classify)
+        return [qcards[i] for i in sorted(to_classify)]
+
+    def update(self, qcards):
+        """Update the tracks with the matched and classified qcards
+
+        Newly classified qcards vote for the attributes of their track,
+        then the attributes of all qcards are set to the voted ones
+        (unset if the vote is not certain yet)."""
+        tracks = {track.track_id: track for track in self.tracks}
+        seen = set()
+        for qcard in qcards:
+            track = tracks.get(qcard.track_id)
+            if track is None:
+                track = CTrack(self.next_track_id, qcard, self.vote_window)
+                self.next_track_id += 1
+                qcard.track_id = track.track_id
+                self.tracks.append(track)
+            track.center = qcard.center
+            track.area = qcard.area
+            track.missing_frames = 0
+            if qcard.classified_from is None:
+                track.history.append(tuple(qcard.get_attributes().values()))
+                track.vote(self.vote_threshold)
+                track.qcard = qcard
+                track.appearance = qcard.get_appearance()
+                track.frames_since_classification = 0
+            else:
+                track.frames_since_classification += 1
+            qcard.set_card(track.voted_card or set_engine.CCard())
+            seen.add(track.track_id)
+
+        for track in self.tracks:
+            if track.track_id not in seen:
+                track.missing_frames += 1
+        self.tracks = [
+            track for track in self.tracks if track.missing_frames <= self.max_missing_frames]
+
+    def skip_frame(self):
+        """Count a frame which was not detected because the game field did
+        not change, so still cards are classified again after
+        reclassify_interval frames and not passes"""
+        for track in self.tracks:
+            track.frames_since_classification += 1
+
+    def is_settled(self):
+        """Returns False while a track is still collecting its first votes"""
+        return all(
+            track.voted_card is not None or len(track.history) == self.vote_window
+            for track in self.tracks)
+
+    def get_reuse_rate(self):
+        """Returns the fraction of cards which were not classified again"""
+        return self.reused / max(self.reused + self.classified, 1)
+
+
+class CSetCache:
+    """Class to run a SET search only if the layout of tracked cards changed"""
+    def __init__(self, find_set):
+        self.find_set = find_set  # set_engine solver
+        self.layout = None  # (track id, card id) of all cards of the last search
+        self.set_track_ids = []  # track ids of the last found SET
+        self.searches = 0
+        self.hits = 0
+
+    def get_set(self, qcards):
+        """Returns the SET of the given tracked qcards like find_set"""
+        layout = tuple(sorted((qcard.track_id, qcard.get_id()) for qcard in qcards))
+        if any(track_id is None for track_id, _ in layout):
+            return self.find_set(qcards)
+
+        if layout != self.layout:
+            self.layout = layout
+            self.set_track_ids = [qcard.track_id for qcard in self.find_set(qcards)]
+            self.searches += 1
+        else:
+            self.hits += 1
+
+        by_track_id = {qcard.track_id: qcard for qcard in qcards}
+        return [by_track_id[track_id] for track_id in self.set_track_ids]
@@ -1,62 +1,121 @@
 """
 This is a script to demonstrate one game round
 """
+import argparse
+import csv
+import json
+import os
 import random
-from tqdm import tqdm
-import matplotlib.pyplot as plt
+import sys
+import time
+from collections import deque, namedtuple
+from functools import lru_cache
+from multiprocessing import Pool
+import numpy as np
 import set_engine as se
 
+# A game has at most 27 SETs (81 cards)
+MAX_SETS_PER_GAME = se.NUM_OF_CARDS // 3
+# Games per simulation chunk, every chunk has its own RNG stream
+CHUNK_SIZE = 1000
+
+# Result of one simulated game
+# sets_found: number of found SETs
+# turns: number of SET searches during the game
+# max_field_size: maximum number of cards on the field
+# solve_time: mean time of a SET search in seconds
+# cards_left: number of cards left on the field at the end of the game
+GameResult = namedtuple(
+    "GameResult", ["sets_found", "turns", "max_field_size", "solve_time", "cards_left"])
+
 
 class CGameField():
     """
     A class to represent the playing field filled with cards
+
+    The deck is a pre-shuffled list of card ids dealt from a pointer,
+    the field is a list of slots holding card ids (None if empty) plus
+    a bitmask over the 81 cards. Dealing and removing cards is O(1).
     """
-    def __init__(self):
+    def __init__(self, deck=None):
         """
-        Init field cards and a full card deck
+        Init field cards and a full card deck,
+        deck is an optional shuffled sequence of card ids
         """
-        self.__field_cards = []
+        self.__field_slots = []
+        self.__free_slots = []
+        self.__slot_of_card = [None] * se.NUM_OF_CARDS
+        self.__field_mask = 0
 
         self.__card_deck = []
-        self.generate_card_deck()
+        self.__deck_pos = 0
+        if deck is None:
+            self.generate_card_deck()
+        else:
+            self.__card_deck = list(deck)
 
     def generate_card_deck(self):
         """
-        Generate a full card deck with all possible cards
+        Generate a full, shuffled card deck with all possible cards
         """
-        card_deck = []
-        for number in se.possible_attributes["number"]:
-            for symbol in se.possible_attributes["symbol"]:
-                for shading in se.possible_attributes["shading"]:
-                    for color in se.possible_attributes["color"]:
-                        card_deck.append(se.CCard(
-                            number, symbol, shading, color))
+        card_deck = list(range(se.NUM_OF_CARDS))
+        random.shuffle(card_deck)
         self.__card_deck = card_deck
+        self.__deck_pos = 0
 
     def get_field_cards(self):
         """
         Returns all field cards as list
         """
-        return self.__field_cards
+        return [se.CARDS[card_id] for card_id in self.__field_slots if card_id is not None]
+
+    def get_field_slots(self):
+        """
+        Returns the card ids of all field slots, None for empty slots
+        """
+        return self.__field_slots
+
+    def get_field_mask(self):
+        """
+        Returns the field cards as bitmask, bit i is set if card id i is on the field
+        """
+        return self.__field_mask
+
+    def get_num_of_field_cards(self):
+        """
+        Returns the number of cards on the field
+        """
+        return len(self.__field_slots) - len(self.__free_slots)
+
+    def get_num_of_deck_cards(self):
+        """
+        Returns the number of cards left in the deck
+        """
+        return len(self.__card_deck) - self.__deck_pos
 
     def pick_random_cards(self, quantity):
         """
         Move random cards of the quantity given from the deck to the field
         """
-        if len(self.__card_deck) <= 0:
+        if self.__deck_pos >= len(self.__card_deck):
             return False
-        for i in range(quantity):  # pylint: disable=unused-variable
-            random_card = random.choice(self.__card_deck)
-            self.__field_cards.append(random_card)
-            self.__card_deck.remove(random_card)
-        # print("Picked "+str(quantity)+" cards\n")
+        for card_id in self.__card_deck[self.__deck_pos:self.__deck_pos + quantity]:
+            if self.__free_slots:
+                slot = self.__free_slots.pop()
+                self.__field_slots[slot] = card_id
+            else:
+                slot = len(self.__field_slots)
+                self.__field_slots.append(card_id)
+            self.__slot_of_card[card_id] = slot
+            self.__field_mask |= 1 << card_id
+        self.__deck_pos = min(self.__deck_pos + quantity, len(self.__card_deck))
         return True
 
     def show_field(self):
         """
         Print attributes of the field cards
         """
-        for card in self.__field_cards:
+        for card in self.get_field_cards():
             print(card.get_attributes())
         print("\n")
 
@@ -64,15 +123,50 @@ class CGameField():
         """
         Print the amount of the cards in the deck and on the field
         """
-        print("Card deck ("+str(len(self.__card_deck))+")")
-        print("Field Cards ("+str(len(self.__field_cards))+"):\n")
+        print("Card deck ("+str(self.get_num_of_deck_cards())+")")
+        print("Field Cards ("+str(self.get_num_of_field_cards())+"):\n")
+
+    def remove_field_slots(self, slots):
+        """
+        Removes the cards of the given slots from field
+        """
+        # free slots are a stack, lowest slot is refilled first
+        for slot in sorted(slots, reverse=True):
+            card_id = self.__field_slots[slot]
+            self.__field_slots[slot] = None
+            self.__free_slots.append(slot)
+            self.__slot_of_card[card_id] = None
+            self.__field_mask &= ~(1 << card_id)
 
     def remove_field_cards(self, cards):
         """
         Removes given card from field
         """
-        for card in cards:
-            self.__field_cards.remove(card)
+        slots = [self.__slot_of_card[card.get_id()] for card in cards]
+        if None in slots:
+            raise ValueError("Card is not on the field")
+        self.remove_field_slots(slots)
+
+    def snapshot(self):
+        """
+        Returns the current state of deck and field, see restore
+        """
+        return (self.__deck_pos, tuple(self.__field_slots), tuple(self.__free_slots))
+
+    def restore(self, snapshot):
+        """
+        Restore a state returned by snapshot (of the same deck)
+        """
+        self.__deck_pos, field_slots, free_slots = snapshot
+        self.__field_slots = list(field_slots)
+        # the order of the free slots decides where the next cards are dealt
+        self.__free_slots = list(free_slots)
+        self.__slot_of_card = [None] * se.NUM_OF_CARDS
+        self.__field_mask = 0
+        for slot, card_id in enumerate(field_slots):
+            if card_id is not None:
+                self.__slot_of_card[card_id] = slot
+                self.__field_mask |= 1 << card_id
 
 
 def play_game(verbose_output=False):
@@ -99,7 +193,7 @@ def play_game(verbose_output=False):
             if verbose_output is False:
                 se.show_cards(set_list)
             myfield.remove_field_cards(set_list)
-            if len(myfield.get_field_cards()) >= 12:
+            if myfield.get_num_of_field_cards() >= 12:
                 pass
             else:
                 if myfield.pick_random_cards(3) is False:
@@ -130,18 +224,396 @@ def play_game(verbose_output=False):
     return set_counter
 
 
-def play_games_and_plot_histogram(number_of_games):
+def mask_to_ids(mask):
+    """
+    Returns the card ids of a field bitmask in ascending order
+    """
+    card_ids = []
+    while mask:
+        low_bit = mask & -mask
+        card_ids.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+    return card_ids
+
+
+def ids_to_mask(card_ids):
+    """
+    Returns the field bitmask of the given card ids
+    """
+    mask = 0
+    for card_id in card_ids:
+        mask |= 1 << card_id
+    return mask
+
+
+@lru_cache(maxsize=1 << 18)
+def max_sets_of_field(mask):
+    """
+    Returns the maximum number of SETs which can be taken one after
+    another from the field cards given as bitmask, with an empty deck
+
+    Exhaustive search over all SET orders, memoized by the field bitmask,
+    so equal endgames of different games are only searched once.
+    """
+    card_ids = mask_to_ids(mask)
+    upper_bound = len(card_ids) // 3
+    best = 0
+    for i, j, k in se.iter_set_indices(card_ids):
+        remaining = mask & ~ids_to_mask((card_ids[i], card_ids[j], card_ids[k]))
+        best = max(best, 1 + max_sets_of_field(remaining))
+        if best == upper_bound:
+            break
+    return best
+
+
+def choose_first(field_slots, sets, rng):  # pylint: disable=unused-argument
+    """
+    Strategy: take the first SET found
+    """
+    return sets[0]
+
+
+def choose_random(field_slots, sets, rng):  # pylint: disable=unused-argument
+    """
+    Strategy: take a random SET
+    """
+    return sets[rng.integers(len(sets))]
+
+
+def _remaining_codes(field_slots, chosen_set):
+    """
+    Returns the field slots without the cards of the chosen SET
+    """
+    return [code for slot, code in enumerate(field_slots) if slot not in chosen_set]
+
+
+def choose_greedy(field_slots, sets, rng):  # pylint: disable=unused-argument
+    """
+    Strategy: take the SET leaving the most SETs on the field
+    """
+    return max(sets, key=lambda chosen_set: se.count_set_codes(
+        _remaining_codes(field_slots, chosen_set)))
+
+
+def choose_lookahead(field_slots, sets, rng):  # pylint: disable=unused-argument
+    """
+    Strategy: take the SET after which the best next SET leaves the most
+    SETs on the field (two SETs deep, without dealing new cards)
+    """
+    def score(chosen_set):
+        remaining = _remaining_codes(field_slots, chosen_set)
+        next_sets = list(se.iter_set_indices(remaining))
+        if not next_sets:
+            return (0, 0)
+        return (1, max(se.count_set_codes(_remaining_codes(remaining, next_set))
+                       for next_set in next_sets))
+    return max(sets, key=score)
+
+
+def choose_endgame(field_slots, sets):
+    """
+    Take the SET maximizing the number of SETs found until the game ends,
+    only exact if the deck is empty
+    """
+    field_mask = ids_to_mask(code for code in field_slots if code is not None)
+
+    def score(chosen_set):
+        return max_sets_of_field(
+            field_mask & ~ids_to_mask(field_slots[slot] for slot in chosen_set))
+    return max(sets, key=score)
+
+
+# Strategies to choose one of the SETs on the field, all take the field
+# slots, the list of SETs as slot triples and a numpy random generator
+STRATEGIES = {
+    "first": choose_first,
+    "random": choose_random,
+    "greedy": choose_greedy,
+    "lookahead": choose_lookahead,
+}
+
+
+def simulate_game(rng, strategy="first", exact_endgame=False, choice_rng=None):
+    """
+    Play one game with integer encoded cards and return a GameResult
+
+    Same rules as play_game, but the SET search works on the card ids of
+    the field slots directly. The strategy chooses which SET is taken,
+    with exact_endgame the SET is chosen by exhaustive search as soon as
+    the deck is empty. choice_rng is used by the random strategy,
+    by default rng.
+    """
+    choose = STRATEGIES[strategy]
+    if choice_rng is None:
+        choice_rng = rng
+    myfield = CGameField(rng.permutation(se.NUM_OF_CARDS).tolist())
+    myfield.pick_random_cards(12)
+    set_counter = 0
+    turns = 0
+    max_field_size = myfield.get_num_of_field_cards()
+    solve_time = 0.0
+
+    while True:
+        field_slots = myfield.get_field_slots()
+        start = time.perf_counter()
+        if choose is choose_first and not exact_endgame:
+            slots = se.find_set_indices(field_slots)
+        else:
+            sets = list(se.iter_set_indices(field_slots))
+            if not sets:
+                slots = ()
+            elif exact_endgame and myfield.get_num_of_deck_cards() <= 0:
+                slots = choose_endgame(field_slots, sets)
+            else:
+                slots = choose(field_slots, sets, choice_rng)
+        solve_time += time.perf_counter() - start
+        turns += 1
+
+        if slots:
+            set_counter += 1
+            myfield.remove_field_slots(slots)
+            if myfield.get_num_of_field_cards() >= 12:
+                continue
+        elif myfield.get_num_of_deck_cards() <= 0:
+            # card deck is empty and no SET left
+            break
+        if myfield.pick_random_cards(3):
+            max_field_size = max(max_field_size, myfield.get_num_of_field_cards())
+
+    return GameResult(set_counter, turns, max_field_size, solve_time / turns,
+                      myfield.get_num_of_field_cards())
+
+
+def simulate_chunk(seed, chunk, number_of_games, strategy="first", exact_endgame=False):
+    """
+    Simulate games of one chunk and return list of GameResults
+
+    The RNG depends only on seed and chunk number, so the result does not
+    depend on which worker simulates the chunk. Decks and SET choices use
+    separate RNGs, so all strategies play the same decks.
+    """
+    rng = np.random.default_rng([seed, chunk, 0])
+    choice_rng = np.random.default_rng([seed, chunk, 1])
+    return [
+        simulate_game(rng, strategy, exact_endgame, choice_rng)
+        for _ in range(number_of_games)
+    ]
+
+
+def _simulate_chunk_job(job):
+    """Unpack job tuple for the process pool"""
+    return simulate_chunk(*job)
+
+
+def _imap_bounded(pool, func, jobs, max_pending):
+    """Like pool.imap, but at most max_pending jobs are submitted ahead of
+    the consumer, so finished chunks do not pile up if it is slower"""
+    pending = deque()
+    for job in jobs:
+        pending.append(pool.apply_async(func, (job,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def iter_game_results(number_of_games, seed=0, workers=None, progress=False,
+                      strategy="first", exact_endgame=False):
+    """
+    Generator yielding the GameResult of 'number_of_games' games in order,
+    simulated chunk by chunk in a process pool
+
+    At most two chunks per worker are in flight, so memory does not grow
+    with the number of games. The results are reproducible for a given
+    seed regardless of the number of workers (except of solve_time).
+    """
+    number_of_chunks = -(-number_of_games // CHUNK_SIZE)
+    jobs = (
+        (seed, chunk, min(CHUNK_SIZE, number_of_games - chunk * CHUNK_SIZE),
+         strategy, exact_endgame)
+        for chunk in range(number_of_chunks)
+    )
+
+    def results_of(chunk_results):
+        if progress:
+            # import only if needed, slows down the start
+            from tqdm import tqdm  # pylint: disable=import-outside-toplevel
+            chunk_results = tqdm(chunk_results, total=number_of_chunks)
+        for results in chunk_results:
+            yield from results
+
+    if workers == 1:
+        yield from results_of(map(_simulate_chunk_job, jobs))
+    else:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        with Pool(workers) as pool:
+            yield from results_of(_imap_bounded(pool, _simulate_chunk_job, jobs, 2 * workers))
+
+
+class CSimulationSummary():
+    """
+    A class to aggregate GameResults incrementally
+    """
+    def __init__(self):
+        self.number_of_games = 0
+        self.sets_histogram = np.zeros(MAX_SETS_PER_GAME + 1, dtype=np.int64)
+        self.field_size_histogram = np.zeros(se.NUM_OF_CARDS + 1, dtype=np.int64)
+        self.cards_left_histogram = np.zeros(se.NUM_OF_CARDS + 1, dtype=np.int64)
+        self.turns = 0
+        self.solve_time = 0.0
+
+    def add(self, result):
+        """
+        Add the GameResult of one game
+        """
+        self.number_of_games += 1
+        self.sets_histogram[result.sets_found] += 1
+        self.field_size_histogram[result.max_field_size] += 1
+        self.cards_left_histogram[result.cards_left] += 1
+        self.turns += result.turns
+        self.solve_time += result.solve_time * result.turns
+
+    def as_dict(self):
+        """
+        Returns the summary as dict, e.g. to dump it as JSON
+        """
+        games = max(self.number_of_games, 1)
+        sets = np.arange(len(self.sets_histogram))
+        return {
+            "games": self.number_of_games,
+            "mean_sets_found": float(self.sets_histogram @ sets / games),
+            "mean_turns": self.turns / games,
+            "mean_cards_left": float(
+                self.cards_left_histogram @ np.arange(len(self.cards_left_histogram)) / games),
+            "mean_solve_time_us": self.solve_time / max(self.turns, 1) * 1e6,
+            "sets_histogram": self.sets_histogram.tolist(),
+            "max_field_size_histogram": {
+                int(size): int(count)
+                for size, count in enumerate(self.field_size_histogram) if count
+            },
+        }
+
+
+class CResultWriter():
+    """
+    A class to stream GameResults to a .csv or .jsonl file
+    """
+    def __init__(self, path):
+        if not path.endswith((".csv", ".jsonl")):
+            raise ValueError(f"Unknown result format of '{path}', use .csv or .jsonl")
+        # pylint: disable-next=consider-using-with
+        self.__file = open(path, "w", newline="", encoding="utf-8")
+        self.__csv_writer = None
+        if path.endswith(".csv"):
+            self.__csv_writer = csv.writer(self.__file)
+            self.__csv_writer.writerow(GameResult._fields)
+
+    def write(self, result):
+        """
+        Write the GameResult of one game
+        """
+        if self.__csv_writer is not None:
+            self.__csv_writer.writerow(result)
+        else:
+            self.__file.write(json.dumps(result._asdict()) + "\n")
+
+    def close(self):
+        """
+        Close the file
+        """
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def simulate_games(number_of_games, seed=0, workers=None, progress=False, writer=None,
+                   strategy="first", exact_endgame=False):
+    """
+    Simulate 'number_of_games' games and return a CSimulationSummary,
+    every GameResult is streamed to the given CResultWriter
+    """
+    summary = CSimulationSummary()
+    for result in iter_game_results(number_of_games, seed, workers, progress,
+                                    strategy, exact_endgame):
+        summary.add(result)
+        if writer is not None:
+            writer.write(result)
+    return summary
+
+
+def compare_strategies(number_of_games, seed=0, workers=None, exact_endgame=False):
+    """
+    Simulate the same games with every strategy,
+    returns dict of strategy name and summary dict
+    """
+    summaries = {}
+    for strategy in STRATEGIES:
+        start = time.perf_counter()
+        summary = simulate_games(number_of_games, seed, workers,
+                                 strategy=strategy, exact_endgame=exact_endgame)
+        summaries[strategy] = summary.as_dict()
+        summaries[strategy]["simulation_time_s"] = time.perf_counter() - start
+    return summaries
+
+
+def plot_histogram(summary):
+    """
+    Plot histogram of found SETs in each game
+    """
+    # import only if needed, slows down the start and needs a display
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+    histogram = summary.sets_histogram
+    plt.bar(np.arange(len(histogram)), histogram)
+    plt.title("Number of found SETs ("+str(summary.number_of_games)+" games)")
+    plt.show()
+
+
+def play_games_and_plot_histogram(number_of_games, seed=0, workers=None):
     """
     Play 'number_of_games' times and plot histogram of found SETs in each game
     """
     print(f"Simulating {number_of_games} games")
-    number_of_found_sets = []
-    for i in tqdm(range(number_of_games)):  # pylint: disable=unused-variable
-        number_of_found_sets.append(play_game(verbose_output=True))
-    plt.hist(number_of_found_sets)
-    plt.title("Number of found SETs ("+str(number_of_games)+" games)")
-    plt.show()
+    plot_histogram(simulate_games(number_of_games, seed, workers, progress=True))
 
 
 if __name__ == '__main__':
-    play_games_and_plot_histogram(1000)
+    parser = argparse.ArgumentParser(description="Simulate SET games")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", help="stream results of every game to .csv or .jsonl")
+    parser.add_argument("--headless", action="store_true",
+                        help="print JSON summary instead of plotting")
+    parser.add_argument("--strategy", choices=STRATEGIES, default="first",
+                        help="how to choose between several SETs on the field")
+    parser.add_argument("--exact-endgame", action="store_true",
+                        help="choose SETs by exhaustive search once the deck is empty")
+    parser.add_argument("--compare", action="store_true",
+                        help="print JSON summary of all strategies on the same games")
+    args = parser.parse_args()
+
+    if args.compare:
+        json.dump(compare_strategies(args.games, args.seed, args.workers, args.exact_endgame),
+                  sys.stdout, indent=1)
+        print()
+    else:
+        if not args.headless:
+            print(f"Simulating {args.games} games")
+        Writer = CResultWriter(args.output) if args.output else None
+        try:
+            Summary = simulate_games(args.games, args.seed, args.workers,
+                                     progress=not args.headless, writer=Writer,
+                                     strategy=args.strategy, exact_endgame=args.exact_endgame)
+        finally:
+            if Writer is not None:
+                Writer.close()
+        if args.headless:
+            json.dump(Summary.as_dict(), sys.stdout)
+            print()
+        else:
+            plot_histogram(Summary)
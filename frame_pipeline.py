@@ -0,0 +1,230 @@
+"""Module to run the card detection as pipeline of threads
+
+capture -> detect -> classify -> solve -> (render in the main thread)
+
+The stages are connected by small queues which drop the oldest frame if
+a stage is slower than its predecessor, so the result always belongs to
+the freshest frame possible and the slowest stage bounds the frame rate
+instead of the sum of all stages.
+
+The detect stage only runs the scene change gate and detect_cards of the
+CCardDetector, everything else (classification, card tracking and the
+last cards of the gate) is only used by the classify stage. An exception
+in a stage stops the pipeline and is raised again by get_result.
+"""
+import queue
+import time
+from collections import deque
+from threading import Thread, Event, Lock
+
+
+class CFrame:
+    """Structure to pass one frame and its results through the pipeline"""
+    def __init__(self, seq, img_raw, capture_time=None):
+        self.seq = seq  # Sequence number of the frame
+        self.capture_time = time.perf_counter() if capture_time is None else capture_time
+        self.img_raw = img_raw
+        self.qcards = []  # Detected, not yet classified query cards, None if unchanged
+        self.cards = []  # Classified cards
+        self.set_cards = []  # Found SET or empty list
+
+
+class CDropQueue:
+    """Bounded queue dropping the oldest item if it is full"""
+    def __init__(self, maxsize=1):
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.lock = Lock()
+
+    def put(self, item):
+        """Put item, drop oldest item if queue is full"""
+        with self.lock:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def get(self, timeout=None):
+        """Get item, raises queue.Empty after timeout"""
+        return self.queue.get(timeout=timeout)
+
+
+class CPipelineStage:
+    """One stage of the pipeline running in its own thread"""
+    def __init__(self, name, func, in_queue, out_queue):
+        self.name = name
+        self.func = func  # func(frame) returns the frame for the next stage or None
+        self.in_queue = in_queue  # None for the first stage
+        self.out_queue = out_queue
+
+        self.processed = 0
+        self.busy_time = 0.0
+        self.error = None  # exception which stopped the stage
+
+    def run(self, stop_event):
+        """Process frames until stop_event is set or func raises,
+        the exception is kept in error and stops all stages"""
+        while not stop_event.is_set():
+            frame = None
+            if self.in_queue is not None:
+                try:
+                    frame = self.in_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+            start = time.perf_counter()
+            try:
+                frame = self.func(frame)
+            except Exception as error:  # pylint: disable=broad-except
+                self.error = error
+                stop_event.set()
+                return
+            self.busy_time += time.perf_counter() - start
+            if frame is None:
+                continue
+            self.processed += 1
+            self.out_queue.put(frame)
+
+
+class CFramePipeline:
+    """Threaded pipeline from frame source to found SET"""
+    def __init__(self, get_frame, card_detector, find_set, max_fps=30):
+        """get_frame() returns the recent image of the frame source or a
+        camera_stream.CameraFrame with its capture time,
+        card_detector is a CCardDetector without warp_buffers, detection
+        runs ahead of classification and would recycle the warp buffers
+        of cards still being classified, find_set a set_engine solver"""
+        if card_detector.buffer_pool is not None:
+            raise ValueError("CFramePipeline needs a CCardDetector without warp_buffers")
+        self.get_frame = get_frame
+        self.card_detector = card_detector
+        self.find_set = find_set
+        self.min_frame_interval = 1 / max_fps if max_fps else 0
+
+        self.seq = 0
+        self.detected_seq = 0  # seq of the last frame with a full detection
+        self.classified_seq = 0  # seq of the last of them classified
+        self.last_capture = 0.0
+        self.latencies = deque(maxlen=100)  # capture to get_result in seconds
+        self.start_time = None
+        self.stop_event = Event()
+        self.threads = []
+
+        self.out_queue = CDropQueue()
+        queues = [CDropQueue() for _ in range(3)] + [self.out_queue]
+        funcs = [
+            ("capture", self.__capture),
+            ("detect", self.__detect),
+            ("classify", self.__classify),
+            ("solve", self.__solve),
+        ]
+        self.stages = [
+            CPipelineStage(name, func, queues[i - 1] if i > 0 else None, queues[i])
+            for i, (name, func) in enumerate(funcs)
+        ]
+
+    def __capture(self, _):
+        """Get a new frame from the source, limited to max_fps"""
+        wait = self.last_capture + self.min_frame_interval - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        self.last_capture = time.perf_counter()
+
+        img_raw = self.get_frame()
+        capture_time = None
+        if isinstance(img_raw, tuple):  # CameraFrame
+            capture_time = img_raw.timestamp
+            img_raw = img_raw.img
+        if img_raw is None or len(img_raw) == 0:
+            return None
+        self.seq += 1
+        return CFrame(self.seq, img_raw, capture_time)
+
+    def __detect(self, frame):
+        # the queue may drop the frame of a change before it is classified,
+        # the gate already compares with the new scene, so detect again
+        # until a detected frame was classified
+        change_pending = self.classified_seq < self.detected_seq
+        if self.card_detector.scene_unchanged(frame.img_raw) and not change_pending:
+            frame.qcards = None
+        else:
+            frame.qcards = self.card_detector.detect_cards(frame.img_raw)
+            self.detected_seq = frame.seq
+        return frame
+
+    def __classify(self, frame):
+        if frame.qcards is None:
+            frame.cards = self.card_detector.get_last_cards()
+        else:
+            frame.cards = self.card_detector.classify_detected_cards(frame.qcards)
+            self.classified_seq = frame.seq
+        return frame
+
+    def __solve(self, frame):
+        frame.set_cards = self.find_set(frame.cards)
+        return frame
+
+    def run(self):
+        """Start all stages as threads"""
+        self.start_time = time.perf_counter()
+        for stage in self.stages:
+            thread = Thread(target=stage.run, args=(self.stop_event,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def get_result(self, timeout=None):
+        """Returns the freshest completely processed CFrame,
+        raises queue.Empty after timeout and the exception of a failed stage"""
+        end = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            for stage in self.stages:
+                if stage.error is not None:
+                    raise stage.error
+            wait = 0.1 if end is None else min(end - time.perf_counter(), 0.1)
+            if wait <= 0:
+                raise queue.Empty
+            try:
+                frame = self.out_queue.get(timeout=wait)
+                break
+            except queue.Empty:
+                continue
+        self.latencies.append(time.perf_counter() - frame.capture_time)
+        return frame
+
+    def stop(self):
+        """Stop all stages"""
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def get_report(self):
+        """Returns dict with throughput and busy time of every stage
+        and the end-to-end latency"""
+        elapsed = time.perf_counter() - self.start_time if self.start_time else 0
+        report = {}
+        for stage in self.stages:
+            report[stage.name] = {
+                "fps": stage.processed / elapsed if elapsed else 0,
+                "ms_per_frame": stage.busy_time / max(stage.processed, 1) * 1e3,
+                "dropped_after": stage.out_queue.dropped,
+            }
+        report["latency_ms"] = (
+            sum(self.latencies) / len(self.latencies) * 1e3 if self.latencies else 0)
+        return report
+
+    def print_report(self):
+        """Print the report of get_report"""
+        report = self.get_report()
+        for name, stats in report.items():
+            if name == "latency_ms":
+                continue
+            print(f"{name:10s}: {stats['fps']:5.1f} fps, {stats['ms_per_frame']:6.1f} ms/frame, "
+                  f"{stats['dropped_after']} frames dropped after")
+        print(f"End-to-end latency: {report['latency_ms']:0.1f} ms")
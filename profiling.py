@@ -0,0 +1,191 @@
+"""Module with lightweight timers of the processing stages
+
+Code is instrumented with
+
+    with profiling.timer("detect.threshold"):
+        ...
+
+or by decorating a function with @profiling.timed("classify.symbol").
+As long as the profiler is disabled, a timer only checks one flag and
+returns a shared no-op context. Enabled, the duration of every call goes
+into a rolling histogram of its stage, which holds the last WINDOW
+durations in logarithmic bins, so percentiles are cheap enough to show
+them in every frame. Stages may be nested, the times are inclusive.
+"""
+import functools
+import math
+import time
+from bisect import bisect_right
+from collections import deque
+from contextlib import nullcontext
+from threading import RLock
+
+WINDOW = 100  # number of recent durations in the histogram of a stage
+BINS_PER_DECADE = 20  # bin width of the histograms, about 12 %
+MIN_DURATION = 1e-6  # lower edge of the first bin in seconds
+MAX_DURATION = 10.0  # lower edge of the last bin in seconds
+
+_NULL_TIMER = nullcontext()
+
+# upper bin edges of the histograms in seconds
+_EDGES = [
+    MIN_DURATION * 10 ** (i / BINS_PER_DECADE)
+    for i in range(round(BINS_PER_DECADE * math.log10(MAX_DURATION / MIN_DURATION)) + 1)
+]
+
+
+class CRollingHistogram:
+    """Histogram of the last window durations in logarithmic bins"""
+    def __init__(self, window=WINDOW):
+        self.counts = [0] * (len(_EDGES) + 1)
+        self.recent = deque(maxlen=window)  # (bin, duration) of the window
+        self.window_sum = 0.0
+        self.count = 0  # all durations since the start
+        self.total = 0.0
+        self.max = 0.0
+        # stages are timed in the classification and pipeline threads,
+        # hold it to read several values of the same window
+        self.lock = RLock()
+
+    def add(self, duration):
+        """Add a duration in seconds, the oldest one leaves the window"""
+        bin_index = bisect_right(_EDGES, duration)
+        with self.lock:
+            if len(self.recent) == self.recent.maxlen:
+                old_bin, old_duration = self.recent[0]
+                self.counts[old_bin] -= 1
+                self.window_sum -= old_duration
+            self.counts[bin_index] += 1
+            self.recent.append((bin_index, duration))
+            self.window_sum += duration
+            self.count += 1
+            self.total += duration
+            self.max = max(self.max, duration)
+
+    def percentile(self, percent):
+        """Returns the upper bin edge of the percentile of the window in
+        seconds, at most the max duration"""
+        with self.lock:
+            if not self.recent:
+                return 0.0
+            rank = percent / 100 * len(self.recent)
+            cumulated = 0
+            for bin_index, count in enumerate(self.counts):
+                cumulated += count
+                if cumulated >= rank and count > 0:
+                    return min(_EDGES[min(bin_index, len(_EDGES) - 1)], self.max)
+            return self.max
+
+    def mean(self):
+        """Returns the mean duration of the window in seconds"""
+        with self.lock:
+            return self.window_sum / len(self.recent) if self.recent else 0.0
+
+
+class _CTimer:
+    """Context measuring one call of a stage"""
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.add(time.perf_counter() - self.start)
+        return False
+
+
+class CProfiler:
+    """Collection of the rolling histograms of all stages and the frame rate"""
+    def __init__(self, window=WINDOW):
+        self.enabled = False
+        self.window = window
+        self.stages = {}  # name: CRollingHistogram, in order of first use
+        self.frame_times = deque(maxlen=window + 1)
+
+    def enable(self, enabled=True):
+        """Start or stop collecting durations"""
+        self.enabled = enabled
+
+    def reset(self):
+        """Drop all collected durations"""
+        self.stages = {}
+        self.frame_times.clear()
+
+    def get_histogram(self, name):
+        """Returns the CRollingHistogram of a stage, created on first use"""
+        histogram = self.stages.get(name)
+        if histogram is None:
+            histogram = self.stages.setdefault(name, CRollingHistogram(self.window))
+        return histogram
+
+    def timer(self, name):
+        """Returns a context manager measuring the stage name"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _CTimer(self.get_histogram(name))
+
+    def timed(self, name):
+        """Decorator measuring every call of a function as stage name"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _CTimer(self.get_histogram(name)):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def tick(self):
+        """Mark the end of a frame for the frame rate"""
+        if self.enabled:
+            self.frame_times.append(time.perf_counter())
+
+    def get_fps(self):
+        """Returns the frame rate of the last window frames"""
+        if len(self.frame_times) < 2:
+            return 0.0
+        return (len(self.frame_times) - 1) / (self.frame_times[-1] - self.frame_times[0])
+
+    def get_stats(self):
+        """Returns dict of every stage with calls and mean, p50, p90 and
+        max of the window in ms"""
+        stats = {}
+        for name, histogram in list(self.stages.items()):
+            with histogram.lock:
+                stats[name] = {
+                    "calls": histogram.count,
+                    "mean_ms": histogram.mean() * 1e3,
+                    "p50_ms": histogram.percentile(50) * 1e3,
+                    "p90_ms": histogram.percentile(90) * 1e3,
+                    "max_ms": histogram.max * 1e3,
+                }
+        return stats
+
+    def get_overlay_lines(self):
+        """Returns short text lines with the frame rate and the mean ms
+        of every stage to draw them into the frame"""
+        lines = [f"FPS: {self.get_fps():0.1f}"]
+        lines += [f"{name}: {stats['mean_ms']:0.1f} ms"
+                  for name, stats in self.get_stats().items()]
+        return lines
+
+    def print_summary(self):
+        """Print calls, total time and percentiles of every stage"""
+        print(f"Profile, {self.get_fps():0.1f} fps over the last {self.window} frames")
+        for name, stats in self.get_stats().items():
+            total = self.stages[name].total
+            print(f"{name:24s}: {stats['calls']:6d} calls, {total:7.2f} s, "
+                  f"mean {stats['mean_ms']:7.2f} ms, p50 {stats['p50_ms']:7.2f} ms, "
+                  f"p90 {stats['p90_ms']:7.2f} ms, max {stats['max_ms']:7.2f} ms")
+
+
+# profiler of the application, the instrumented modules use it
+profiler = CProfiler()
+timer = profiler.timer
+timed = profiler.timed
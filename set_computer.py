@@ -1,28 +1,71 @@
 import cv2 as cv
 from playsound import playsound
 
+import profiling
 import set_engine
-from card_detection import CCardDetector
-from utilities import draw_card_contours, draw_attributes, draw_num_of_cards, show_img_from_cards
+from camera_stream import CCameraStream, create_frame_source
+from card_detection import CCardDetector, CSceneChangeGate
+from card_tracking import CCardTracker, CSetCache
+from frame_pipeline import CFramePipeline
+from utilities import draw_card_contours, draw_attributes, draw_num_of_cards, draw_profile, \
+    show_img_from_cards
 
 ###########################################
 TARGET = True
 GAMEMODE = True
 # Possible: True or False
 # True: running on Raspberry Pi with Camera
-# False:running on Host loading local image
+# False:running on Host loading local image or replaying FRAME_SOURCE
+SOLVER = "indexed"
+# Possible: see set_engine.SOLVERS
+# "primitive", "indexed": rule based on the classified attributes
+# "cnn": learned scorer on the card images, train it with card_cnn.py
+CLASSIFY_WORKERS = 0
+# 0: classify cards one after another
+# > 0: classify cards in parallel in a thread pool of this size
+TRACK_CARDS = True
+# True: cards which did not move keep their attributes, only new or
+#       moved cards are classified, see card_tracking.py
+#       The attributes are the majority vote of the last VOTE_WINDOW
+#       classifications, a value needs COUNTER_CERTAINTY votes.
+#       The SET search only runs if the voted layout changed.
+DETECTION_SCALE = 0.5
+# < 1: search card contours in a downscaled frame,
+#      cards are still flattened from the full resolution
+#      Use 1/n (0.5, 0.33...), other scales are not faster than 1.
+#      0.5 saves about 0.6 of 3 ms detection per 1280x720 frame on the host.
+SKIP_STATIC_FRAMES = True
+# True: detection only runs if the game field changed (or every 30 frames),
+#       see card_detection.CSceneChangeGate
+PIPELINE = False
+# True: capture, detection, classification and SET search run as
+#       threaded pipeline, see frame_pipeline.py
+VOTE_SYMBOLS = True
+# True: all symbols of a card vote for the symbol, False: only the first one
+DEBUG_IMAGES = False
+# True: keep all images of the card classification in the cards,
+# False: only calculate the images shown by show_img_from_cards on demand
+PROFILE = False
+# True: time the processing stages, show the FPS and ms per stage in the
+#       frame and print a summary on exit, see profiling.py
+#       (classification in worker processes is not included)
 ###########################################
 
 if TARGET:
-    from camera_stream import CCameraStream
+    FRAME_SOURCE = "picamera"
     WIN_FLATTEN_W = 80
     WIN_FLATTEN_H = 120
 
     WIN_BIG_W = 600
     WIN_BIG_H = 360
 
+    VOTE_WINDOW = 3
     COUNTER_CERTAINTY = 2
 else:
+    FRAME_SOURCE = None
+    # None: only show IMG_PATH
+    # directory or glob pattern of images ("Imgs/") or video file:
+    #     replay it as live stream, see camera_stream.create_frame_source
     # IMG_PATH = "Imgs/2022-08-14_12-16-12.png" # purple is rather black
     IMG_PATH = "Imgs/2022-08-11_14-42-06.png" # wrong card on field
     # IMG_PATH = "Imgs/2022-08-10_18-33-38.png" # strong warm and cold light
@@ -34,6 +77,10 @@ else:
     WIN_BIG_W = 1280
     WIN_BIG_H = 720
 
+    # only one frame, no voting over frames
+    VOTE_WINDOW = 1
+    COUNTER_CERTAINTY = 1
+
 if GAMEMODE:
     WIN_FLATTEN_W = 100
     WIN_FLATTEN_H = 150
@@ -51,35 +98,67 @@ def exit_programm(event, x, y, flags, param):
 
 
 if __name__ == '__main__':
-    if TARGET:
-        CamStream = CCameraStream((1280, 720), fps=30)
+    LIVE = FRAME_SOURCE is not None
+    if LIVE:
+        CamStream = CCameraStream(
+            fps=30, source=create_frame_source(FRAME_SOURCE, (1280, 720), fps=30))
         CamStream.run()
+    CardDetector = CCardDetector(
+        workers=CLASSIFY_WORKERS,
+        tracker=CCardTracker(vote_window=VOTE_WINDOW, vote_threshold=COUNTER_CERTAINTY)
+                if TRACK_CARDS else None,
+        gate=CSceneChangeGate() if SKIP_STATIC_FRAMES else None,
+        detection_scale=DETECTION_SCALE,
+        debug_images=DEBUG_IMAGES,
+        vote_symbols=VOTE_SYMBOLS)
+    Pipeline = None
+    profiling.profiler.enable(PROFILE)
     try:
-        CardDetector = CCardDetector()
-
         if GAMEMODE:
             cv.namedWindow("CardDetection", cv.WND_PROP_FULLSCREEN)
             cv.setWindowProperty("CardDetection",cv.WND_PROP_FULLSCREEN,cv.WINDOW_FULLSCREEN)
             cv.setMouseCallback("CardDetection", exit_programm)
 
+        find_set = set_engine.get_solver(SOLVER)
+        if TRACK_CARDS:
+            find_set = CSetCache(find_set).get_set
         set_found = False
 
+        if PIPELINE:
+            Pipeline = CFramePipeline(
+                (lambda: CamStream.get_latest(timeout=0.5)) if LIVE
+                else lambda: cv.imread(IMG_PATH),
+                CardDetector, find_set)
+            Pipeline.run()
+
         while True:
-            if TARGET:
-                img_raw = CamStream.get()
+            if PIPELINE:
+                Frame = Pipeline.get_result()
+                img_raw, Cards, set_cards = Frame.img_raw, Frame.cards, Frame.set_cards
             else:
-                img_raw = cv.imread(IMG_PATH)
-
-            Cards = CardDetector.get_cards_from_img(img_raw)
-            draw_card_contours(img_raw, Cards, (0, 0, 255))
-
-            set_cards = set_engine.find_set_primitive_loop(Cards)
+                if LIVE:
+                    # wait for a new frame instead of processing one twice
+                    CamFrame = CamStream.get_latest(timeout=1)
+                    if CamFrame is None:
+                        if not CamStream.running:
+                            break  # end of the frame source
+                        continue
+                    img_raw = CamFrame.img
+                else:
+                    img_raw = cv.imread(IMG_PATH)
+
+                Cards = CardDetector.get_cards_from_img(img_raw)
+                set_cards = find_set(Cards)
+
+            # the cards flatten their debug images lazily from img_raw, draw on a copy
+            img_show = img_raw.copy()
+            draw_card_contours(img_show, Cards, (0, 0, 255))
 
             if len(set_cards) == 3:
                 # SET found!
                 if set_found is False:
                     playsound("set_audio_sample.wav")
-                draw_card_contours(img_raw, set_cards, (0, 255, 0))
+                draw_card_contours(img_show, set_cards, (0, 255, 0))
                 show_img_from_cards(set_cards, "warp_white_balanced", \
                     "Found SET", (WIN_FLATTEN_W, WIN_FLATTEN_H))
                 set_found = True
@@ -87,13 +166,16 @@ if __name__ == '__main__':
                 cv.destroyWindow("Found SET")
                 set_found = False
 
-            draw_attributes(img_raw, Cards)
-            draw_num_of_cards(img_raw, Cards)
+            draw_attributes(img_show, Cards)
+            draw_num_of_cards(img_show, Cards)
+            if PROFILE:
+                profiling.profiler.tick()
+                draw_profile(img_show, profiling.profiler.get_overlay_lines())
 
             if GAMEMODE:
-                cv.imshow("CardDetection", cv.resize(img_raw, (WIN_BIG_W, WIN_BIG_H)))
+                cv.imshow("CardDetection", cv.resize(img_show, (WIN_BIG_W, WIN_BIG_H)))
             else:
-                cv.imshow("CardDetection", cv.resize(img_raw, (WIN_BIG_W, WIN_BIG_H)))
+                cv.imshow("CardDetection", cv.resize(img_show, (WIN_BIG_W, WIN_BIG_H)))
 
                 # show_img_from_cards(Cards, "warp_symbol_center_boxes", "Shading Detection", \
                 #     (WIN_FLATTEN_W, WIN_FLATTEN_H))
@@ -110,7 +192,9 @@ if __name__ == '__main__':
                 show_img_from_cards(Cards, "warp_white_balanced", "White balanced", \
                     (WIN_FLATTEN_W, WIN_FLATTEN_H))
 
-            if TARGET:
+            if LIVE:
+                if not PIPELINE:
+                    CamStream.mark_displayed(CamFrame)
                 key = cv.waitKey(1) & 0xFF
 
                 # if `q` key was pressed, break from the loop
@@ -121,6 +205,15 @@ if __name__ == '__main__':
                 cv.waitKey(0)
                 break
     finally:
+        if Pipeline is not None:
+            Pipeline.stop()
+            Pipeline.print_report()
+        if CardDetector.gate is not None:
+            print("Scene change gate:", CardDetector.gate.get_report())
+        CardDetector.close()
         cv.destroyAllWindows()
-        if TARGET:
+        if LIVE:
             CamStream.stop()
+            print("Camera stream:", CamStream.get_report())
+        if PROFILE:
+            profiling.profiler.print_summary()
@@ -1,8 +1,50 @@
 """
 This module is to test "set_computer.py"
 """
+import copy
+import itertools
+import pickle
+import random
+import threading
+import time
 import unittest
+import numpy as np
 import set_engine as se
+import demo_game
+from demo_game import CGameField
+
+
+def all_cards():
+    """
+    Returns a list of all 81 cards
+    """
+    return [se.decode_card(code) for code in range(se.NUM_OF_CARDS)]
+
+
+def tracked_qcards(raw, positions, size_wh=(100, 150)):
+    """
+    Returns query cards of rectangles at the given top left positions of raw
+    """
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CQueryCard
+    qcards = []
+    for x, y in positions:
+        pts = np.float32([[[x, y]], [[x + size_wh[0], y]],
+                          [[x + size_wh[0], y + size_wh[1]]], [[x, y + size_wh[1]]]])
+        qcards.append(CQueryCard(np.int32(pts), raw, pts))
+    return qcards
+
+
+def track_frame(tracker, qcards, cards):
+    """
+    Match qcards, "classify" the returned ones as the card of their
+    index in cards and update the tracker, returns the classified qcards
+    """
+    to_classify = tracker.match(qcards)
+    for qcard in to_classify:
+        qcard.set_card(cards[qcards.index(qcard)])
+    tracker.update(qcards)
+    return to_classify
 
 
 class TestStringMethods(unittest.TestCase):
@@ -47,8 +89,41 @@ class TestStringMethods(unittest.TestCase):
 
         self.assertFalse(card1 == card2)
 
-        with self.assertRaises(NotImplementedError):
-            self.assertTrue(card1 == "ohgotteinFEHLER")
+        self.assertFalse(card1 == "ohgotteinFEHLER")
+        self.assertTrue(card1 != "ohgotteinFEHLER")
+
+    def test_interned_cards(self):
+        """
+        Test that cards are interned, hashable and have an id
+        """
+        card1 = se.CCard(1, "oval", "solid", "red")
+        self.assertIs(card1, se.CCard(1, "oval", "solid", "red"))
+        self.assertIs(card1, se.decode_card(card1.get_id()))
+        self.assertIs(card1, copy.deepcopy(card1))
+        self.assertIs(card1, pickle.loads(pickle.dumps(card1)))
+        self.assertEqual(len(set(all_cards() + all_cards())), 81)
+        self.assertEqual(sorted(card.get_id() for card in all_cards()), list(range(81)))
+
+        with self.assertRaises(AttributeError):
+            card1.color = "green"
+
+        card2 = se.CCard(1, "oval", "", "red")
+        self.assertIsNone(card2.get_id())
+        self.assertIsNot(card2, se.CCard(1, "oval", "", "red"))
+        self.assertEqual(card2, se.CCard(1, "oval", "", "red"))
+        self.assertEqual(hash(card2), hash(se.CCard(1, "oval", "", "red")))
+
+    def test_query_card_unhashable(self):
+        """
+        Test that mutable query cards are not hashable like CCard
+        """
+        # pylint: disable=import-outside-toplevel
+        from card_detection import CQueryCard
+        qcard = CQueryCard.from_warp(np.zeros((300, 200, 3), np.uint8))
+        with self.assertRaises(TypeError):
+            hash(qcard)
+        qcard.set_card(se.CCard(1, "oval", "solid", "red"))
+        self.assertEqual(qcard, se.CCard(1, "oval", "solid", "red"))
 
     def test_get_methods(self):
         """
@@ -78,6 +153,655 @@ class TestStringMethods(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             se.is_a_set(card1, card2, "hello marvin")
 
+    def test_encode_card(self):
+        """
+        Test integer encoding of cards
+        """
+        self.assertEqual(se.encode_card(se.CCard(1, "oval", "empty", "red")), 0)
+        self.assertEqual(se.encode_card(se.CCard(3, "wave", "solid", "purple")), 80)
+        self.assertIsNone(se.encode_card(se.CCard(1, "oval", "", "red")))
+
+        for code in range(se.NUM_OF_CARDS):
+            self.assertEqual(se.encode_card(se.decode_card(code)), code)
+
+        with self.assertRaises(ValueError):
+            se.decode_card(81)
+
+    def test_complete_set_code(self):
+        """
+        Test that the completing card forms a SET with every pair
+        """
+        cards = all_cards()
+        for code1, code2 in itertools.combinations(range(se.NUM_OF_CARDS), 2):
+            code3 = se.complete_set_code(code1, code2)
+            self.assertNotIn(code3, (code1, code2))
+            self.assertTrue(se.is_a_set(cards[code1], cards[code2], cards[code3]))
+
+    def test_completion_table(self):
+        """
+        Test completion table and table based is_a_set against check_val
+        """
+        self.assertEqual(se.COMPLETION_TABLE.shape, (81, 81))
+        self.assertTrue((se.COMPLETION_TABLE == se.COMPLETION_TABLE.T).all())
+
+        cards = all_cards()
+        rng = random.Random(3)
+        for card1, card2 in itertools.product(cards, repeat=2):
+            card3 = rng.choice(cards)
+            expected = all(
+                se.check_val(
+                    card1.get_attributes()[key],
+                    card2.get_attributes()[key],
+                    card3.get_attributes()[key])
+                for key in se.ATTRIBUTE_KEYS
+            )
+            self.assertEqual(se.is_a_set(card1, card2, card3), expected)
+
+            completion = se.complete_set(card1, card2)
+            self.assertTrue(se.is_a_set(card1, card2, completion))
+
+        self.assertIsNone(se.complete_set(cards[0], se.CCard(1, "oval", "", "red")))
+        self.assertFalse(se.is_a_set(
+            se.CCard(1, "oval", "", "red"), se.CCard(2, "oval", "", "red"),
+            se.CCard(3, "oval", "", "green")))
+
+    def test_find_set(self):
+        """
+        Test SET search on known layouts and the solvers against each other
+        """
+        red_ovals = [se.CCard(number, "oval", "empty", "red") for number in (1, 2, 3)]
+        mixed = [
+            se.CCard(1, "oval", "solid", "green"),
+            se.CCard(2, "wave", "empty", "red"),
+            se.CCard(1, "diamond", "hatched", "red"),
+            se.CCard(3, "oval", "solid", "red"),
+            se.CCard(3, "wave", "empty", "purple"),
+        ]
+        no_set = [se.CCard(1, "oval", "empty", "red"), se.CCard(2, "oval", "empty", "red"),
+                  se.CCard(1, "wave", "empty", "red"), se.CCard(2, "wave", "empty", "red")]
+        for solver in (se.find_set_brute_force, se.find_set_indexed, se.find_set_primitive_loop):
+            self.assertEqual(solver(red_ovals[:2]), [])
+            self.assertEqual(solver(red_ovals), red_ovals)
+            self.assertEqual(solver(mixed), [mixed[1], mixed[2], mixed[3]])
+            self.assertEqual(solver(no_set), [])
+
+        rng = random.Random(0)
+        for _ in range(300):
+            cards = rng.sample(all_cards(), rng.randint(3, 21))
+            found = se.find_set_brute_force(cards)
+            self.assertEqual(len(found) == 3, se.count_sets(cards) > 0)
+            if found:
+                self.assertTrue(se.is_a_set(*found))
+            self.assertEqual(se.find_set_indexed(cards), found)
+            self.assertEqual(se.find_set_primitive_loop(cards), found)
+
+    def test_get_solver(self):
+        """
+        Test selection of the SET search function
+        """
+        self.assertIs(se.get_solver("indexed"), se.find_set_indexed)
+        self.assertIs(se.get_solver("primitive"), se.find_set_brute_force)
+        self.assertIs(se.get_solver("cnn"), se.find_set_cnn)
+
+        with self.assertRaises(ValueError):
+            se.get_solver("quantum")
+
+    def test_find_all_sets(self):
+        """
+        Test search of all SETs and counting against brute force search
+        """
+        cards = all_cards()
+        self.assertEqual(se.count_sets(cards), 1080)
+        self.assertEqual(len(se.find_all_sets(cards)), 1080)
+
+        rng = random.Random(1)
+        for _ in range(100):
+            cards = rng.sample(all_cards(), rng.randint(0, 21))
+            expected = [
+                [cards[i], cards[j], cards[k]]
+                for i, j, k in itertools.combinations(range(len(cards)), 3)
+                if se.is_a_set(cards[i], cards[j], cards[k])
+            ]
+            self.assertEqual(se.find_all_sets(cards), expected)
+            self.assertEqual(list(se.iter_sets(cards)), expected)
+            self.assertEqual(se.count_sets(cards), len(expected))
+
+        # same card twice on the field
+        cards = [se.decode_card(code) for code in (0, 1, 2, 2)]
+        self.assertEqual(se.count_sets(cards), 2)
+        self.assertEqual(len(se.find_all_sets(cards)), 2)
+
+    def test_batch_find_sets(self):
+        """
+        Test vectorized batch solver against is_a_set and find_set_indices
+        """
+        rng = random.Random(2)
+        layouts = [rng.sample(all_cards(), 12) for _ in range(200)]
+        layouts_arr = np.array([se.cards_to_array(cards) for cards in layouts])
+
+        mask = se.batch_set_mask(layouts_arr, chunk_size=64)
+        triples = se.triple_index_table(12)
+        for cards, row in zip(layouts, mask):
+            expected = [se.is_a_set(*[cards[i] for i in triple]) for triple in triples]
+            self.assertEqual(row.tolist(), expected)
+
+        has_set, counts, first = se.batch_find_sets(layouts_arr)
+        for i, cards in enumerate(layouts):
+            codes = [se.encode_card(card) for card in cards]
+            self.assertEqual(counts[i], se.count_sets(cards))
+            self.assertEqual(has_set[i], counts[i] > 0)
+            indices = se.find_set_indices(codes)
+            self.assertEqual(tuple(first[i]), indices if indices else (-1, -1, -1))
+
+        with self.assertRaises(ValueError):
+            se.batch_find_sets(np.zeros((2, 12, 3)))
+
+    def test_game_field_snapshot(self):
+        """
+        Test that a restored game field deals the same cards into the same slots
+        """
+        field = CGameField(deck=random.Random(4).sample(range(se.NUM_OF_CARDS), 81))
+        field.pick_random_cards(12)
+        # two removals, the free slots are not sorted anymore
+        field.remove_field_slots([3, 4, 5])
+        field.remove_field_slots([7, 1])
+        snapshot = field.snapshot()
+        mask = field.get_field_mask()
+
+        field.pick_random_cards(3)
+        expected_slots = list(field.get_field_slots())
+        field.remove_field_cards(field.get_field_cards()[:3])
+        field.pick_random_cards(6)
+
+        field.restore(snapshot)
+        self.assertEqual(field.get_field_mask(), mask)
+        self.assertEqual(field.get_num_of_field_cards(), 7)
+        field.pick_random_cards(3)
+        self.assertEqual(field.get_field_slots(), expected_slots)
+        self.assertEqual(field.snapshot()[0], snapshot[0] + 3)
+
+    def test_max_sets_of_field(self):
+        """
+        Test exhaustive endgame search against a plain recursion
+        """
+        def max_sets_reference(card_ids):
+            best = 0
+            for i, j, k in se.iter_set_indices(card_ids):
+                remaining = [card_id for index, card_id in enumerate(card_ids)
+                             if index not in (i, j, k)]
+                best = max(best, 1 + max_sets_reference(remaining))
+            return best
+
+        self.assertEqual(demo_game.max_sets_of_field(0), 0)
+        self.assertEqual(demo_game.max_sets_of_field(demo_game.ids_to_mask([0, 1, 2])), 1)
+        rng = random.Random(5)
+        for _ in range(30):
+            card_ids = sorted(rng.sample(range(se.NUM_OF_CARDS), rng.randint(3, 10)))
+            mask = demo_game.ids_to_mask(card_ids)
+            self.assertEqual(demo_game.mask_to_ids(mask), card_ids)
+            self.assertEqual(demo_game.max_sets_of_field(mask), max_sets_reference(card_ids))
+
+    def test_strategies(self):
+        """
+        Test that every strategy takes one of the SETs on the field
+        and greedy and endgame choose their best SET
+        """
+        rng = random.Random(6)
+        choice_rng = np.random.default_rng(6)
+        for _ in range(30):
+            field_slots = rng.sample(range(se.NUM_OF_CARDS), 12)
+            for slot in rng.sample(range(12), 2):
+                field_slots[slot] = None
+            sets = list(se.iter_set_indices(field_slots))
+            if not sets:
+                continue
+            for name, choose in demo_game.STRATEGIES.items():
+                self.assertIn(choose(field_slots, sets, choice_rng), sets, name)
+            self.assertEqual(demo_game.choose_first(field_slots, sets, choice_rng), sets[0])
+
+            def remaining_sets(chosen_set, field_slots=field_slots):
+                return se.count_set_codes(
+                    [code for slot, code in enumerate(field_slots) if slot not in chosen_set])
+            self.assertEqual(
+                remaining_sets(demo_game.choose_greedy(field_slots, sets, choice_rng)),
+                max(remaining_sets(chosen_set) for chosen_set in sets))
+
+            chosen_set = demo_game.choose_endgame(field_slots, sets)
+            field_ids = [code for code in field_slots if code is not None]
+            remaining = [code for slot, code in enumerate(field_slots)
+                         if code is not None and slot not in chosen_set]
+            self.assertEqual(
+                1 + demo_game.max_sets_of_field(demo_game.ids_to_mask(remaining)),
+                demo_game.max_sets_of_field(demo_game.ids_to_mask(field_ids)))
+
+    def test_simulation_workers(self):
+        """
+        Test that the simulated games do not depend on the number of workers
+        """
+        chunk_size = demo_game.CHUNK_SIZE
+        demo_game.CHUNK_SIZE = 20  # several chunks with few games
+        try:
+            summaries = [
+                demo_game.simulate_games(70, seed=7, workers=workers,
+                                         strategy="random").as_dict()
+                for workers in (1, 2)
+            ]
+        finally:
+            demo_game.CHUNK_SIZE = chunk_size
+        for summary in summaries:
+            del summary["mean_solve_time_us"]
+        self.assertEqual(summaries[0]["games"], 70)
+        self.assertEqual(summaries[0], summaries[1])
+
+    def test_scene_change_gate(self):
+        """
+        Test that the CSceneChangeGate skips unchanged frames, forces a
+        full pass after max_skipped_frames and after invalidate
+        """
+        # pylint: disable=import-outside-toplevel
+        from card_detection import CSceneChangeGate
+
+        gate = CSceneChangeGate(max_skipped_frames=3)
+        layout_a = np.zeros((180, 320, 3), np.uint8)
+        layout_b = layout_a.copy()
+        layout_b[20:80, 40:100] = 255
+        noisy_a = layout_a + np.uint8(5)
+
+        self.assertTrue(gate.is_changed(layout_a))
+        self.assertFalse(gate.is_changed(layout_a))
+        self.assertFalse(gate.is_changed(noisy_a))
+        self.assertTrue(gate.is_changed(layout_b))
+        self.assertFalse(gate.is_changed(layout_b))
+
+        # forced full pass after 3 skipped frames
+        self.assertFalse(gate.is_changed(layout_b))
+        self.assertFalse(gate.is_changed(layout_b))
+        self.assertTrue(gate.is_changed(layout_b))
+        self.assertFalse(gate.is_changed(layout_b))
+
+        gate.invalidate()
+        self.assertTrue(gate.is_changed(layout_b))
+        self.assertFalse(gate.is_changed(layout_b))
+        report = gate.get_report()
+        self.assertEqual(report["frames"], 11)
+        self.assertAlmostEqual(report["hit_rate"], 7 / 11)
+
+    def test_pipeline_scene_change(self):
+        """
+        Test that the pipeline shows a new scene although its first frame
+        is dropped while the classification is busy
+        """
+        # pylint: disable=import-outside-toplevel
+        from card_detection import CSceneChangeGate
+        from frame_pipeline import CFramePipeline
+
+        class CSlowDetector:
+            """Detector whose only "card" is the grey value of the frame"""
+            buffer_pool = None
+
+            def __init__(self):
+                self.gate = CSceneChangeGate(max_skipped_frames=1000)
+                self.last_cards = []
+
+            def scene_unchanged(self, raw):
+                return not self.gate.is_changed(raw)
+
+            def detect_cards(self, raw):
+                return [int(raw[0, 0, 0])]
+
+            def classify_detected_cards(self, qcards):
+                time.sleep(0.2)
+                self.last_cards = qcards
+                return qcards
+
+            def get_last_cards(self):
+                return self.last_cards
+
+        layouts = [np.full((90, 160, 3), value, np.uint8) for value in (0, 100, 200)]
+        start = time.perf_counter()
+
+        def get_frame():
+            # layout B appears while the change to A2 is classified
+            elapsed = time.perf_counter() - start
+            return layouts[(elapsed > 0.25) + (elapsed > 0.3)]
+
+        pipeline = CFramePipeline(get_frame, CSlowDetector(), lambda cards: [], max_fps=100)
+        pipeline.run()
+        try:
+            cards = []
+            while time.perf_counter() - start < 1.5 and cards != [200]:
+                cards = pipeline.get_result(timeout=1).cards
+        finally:
+            pipeline.stop()
+        self.assertEqual(cards, [200])
+
+    def test_pipeline_stage_error(self):
+        """
+        Test that an exception in a pipeline stage is raised by get_result
+        """
+        # pylint: disable=import-outside-toplevel
+        from frame_pipeline import CFramePipeline
+
+        class CStubDetector:
+            """Card detector without cards"""
+            last_cards = []
+            buffer_pool = None
+
+            def scene_unchanged(self, _):
+                return False
+
+            def detect_cards(self, _):
+                return []
+
+            def classify_detected_cards(self, qcards):
+                return qcards
+
+        def failing_solver(_):
+            raise RuntimeError("solver failed")
+
+        pipeline = CFramePipeline(
+            lambda: np.zeros((4, 4, 3), np.uint8), CStubDetector(), failing_solver, max_fps=0)
+        pipeline.run()
+        try:
+            with self.assertRaisesRegex(RuntimeError, "solver failed"):
+                pipeline.get_result(timeout=5)
+        finally:
+            pipeline.stop()
+
+        # detection runs ahead of classification and would recycle warp buffers
+        pooled_detector = CStubDetector()
+        pooled_detector.buffer_pool = object()
+        with self.assertRaises(ValueError):
+            CFramePipeline(lambda: None, pooled_detector, failing_solver)
+
+    def test_tracker_replaced_card(self):
+        """
+        Test that a card replaced at the same place is classified again
+        and still cards are classified again after reclassify_interval frames
+        """
+        # pylint: disable=import-outside-toplevel
+        from card_tracking import CCardTracker
+
+        raw = np.full((300, 400, 3), 40, np.uint8)
+        raw[50:200, 50:150] = (230, 230, 230)
+        raw[100:150, 70:130] = (0, 0, 200)
+        cards = [se.CCard(1, "oval", "solid", "red")]
+        tracker = CCardTracker(vote_window=1, vote_threshold=1, reclassify_interval=5)
+        self.assertEqual(len(track_frame(tracker, tracked_qcards(raw, [(50, 50)]), cards)), 1)
+        self.assertEqual(track_frame(tracker, tracked_qcards(raw, [(50, 50)]), cards), [])
+
+        replaced = raw.copy()
+        replaced[100:150, 70:130] = (0, 200, 0)
+        cards = [se.CCard(1, "oval", "solid", "green")]
+        qcards = tracked_qcards(replaced, [(50, 50)])
+        self.assertEqual(len(track_frame(tracker, qcards, cards)), 1)
+        self.assertEqual(qcards[0].get_color(), "green")
+        self.assertEqual(track_frame(tracker, tracked_qcards(replaced, [(50, 50)]), cards), [])
+
+        # frames skipped by a scene change gate count for reclassify_interval
+        for _ in range(5):
+            tracker.skip_frame()
+        self.assertEqual(
+            len(track_frame(tracker, tracked_qcards(replaced, [(50, 50)]), cards)), 1)
+
+    def test_tracker_vote(self):
+        """
+        Test majority vote with threshold, history reset on moved or
+        missing cards and is_settled
+        """
+        # pylint: disable=import-outside-toplevel
+        from card_tracking import CCardTracker
+
+        with self.assertRaises(ValueError):
+            CCardTracker(vote_window=3, vote_threshold=4)
+
+        raw = np.full((300, 400, 3), 200, np.uint8)
+        red = se.CCard(1, "oval", "solid", "red")
+        green = se.CCard(1, "oval", "solid", "green")
+        tracker = CCardTracker(vote_window=3, vote_threshold=2)
+
+        qcards = tracked_qcards(raw, [(50, 50)])
+        track_frame(tracker, qcards, [red])
+        self.assertIsNone(qcards[0].get_id())  # one vote is not certain
+        self.assertFalse(tracker.is_settled())
+        qcards = tracked_qcards(raw, [(50, 50)])
+        track_frame(tracker, qcards, [green])
+        self.assertIsNone(qcards[0].get_id())  # no majority
+        qcards = tracked_qcards(raw, [(50, 50)])
+        track_frame(tracker, qcards, [red])
+        self.assertIs(qcards[0].get_card(), red)  # 2 of 3 votes
+        self.assertTrue(tracker.is_settled())
+
+        # certain votes are reused for still cards
+        qcards = tracked_qcards(raw, [(51, 50)])
+        self.assertEqual(track_frame(tracker, qcards, [green]), [])
+        self.assertIs(qcards[0].get_card(), red)
+
+        # a moved card starts a new vote
+        qcards = tracked_qcards(raw, [(80, 50)])
+        self.assertEqual(len(track_frame(tracker, qcards, [green])), 1)
+        self.assertIsNone(qcards[0].get_id())
+        self.assertEqual(len(tracker.tracks), 1)
+        track_frame(tracker, tracked_qcards(raw, [(80, 50)]), [green])
+        self.assertIs(tracker.tracks[0].voted_card, green)
+
+        # a card missing for a frame starts a new vote
+        track_frame(tracker, [], [])
+        qcards = tracked_qcards(raw, [(80, 50)])
+        self.assertEqual(len(track_frame(tracker, qcards, [green])), 1)
+        self.assertIsNone(qcards[0].get_id())
+
+        # tracks are removed after max_missing_frames
+        for _ in range(tracker.max_missing_frames + 1):
+            track_frame(tracker, [], [])
+        self.assertEqual(tracker.tracks, [])
+        self.assertTrue(tracker.is_settled())
+
+    def test_set_cache(self):
+        """
+        Test that the SET search only runs if the layout of tracked cards changed
+        """
+        # pylint: disable=import-outside-toplevel
+        from card_tracking import CCardTracker, CSetCache
+
+        raw = np.full((400, 600, 3), 200, np.uint8)
+        positions = [(20, 20), (200, 20), (380, 20), (20, 220)]
+        cards = [se.decode_card(code) for code in (0, 1, 2, 5)]
+        tracker = CCardTracker(vote_window=1, vote_threshold=1)
+        cache = CSetCache(se.find_set_indexed)
+
+        qcards = tracked_qcards(raw, positions)
+        track_frame(tracker, qcards, cards)
+        self.assertEqual(cache.get_set(qcards), qcards[:3])
+        qcards = tracked_qcards(raw, positions)
+        track_frame(tracker, qcards, cards)
+        self.assertEqual(cache.get_set(qcards), qcards[:3])
+        self.assertIs(cache.get_set(qcards)[0], qcards[0])
+        self.assertEqual((cache.searches, cache.hits), (1, 2))
+
+        # other layout
+        qcards = tracked_qcards(raw, positions[1:])
+        track_frame(tracker, qcards, cards[1:])
+        self.assertEqual(cache.get_set(qcards), [])
+        self.assertEqual((cache.searches, cache.hits), (2, 2))
+
+        # untracked cards are always searched
+        untracked = tracked_qcards(raw, positions)
+        for qcard, card in zip(untracked, cards):
+            qcard.set_card(card)
+        self.assertEqual(cache.get_set(untracked), untracked[:3])
+        self.assertEqual((cache.searches, cache.hits), (2, 2))
+
+
+    def test_frame_ring_buffer(self):
+        """
+        Test the sequence numbers, counters and slot reuse of the
+        CFrameRingBuffer
+        """
+        # pylint: disable=import-outside-toplevel
+        from camera_stream import CFrameRingBuffer
+
+        ring = CFrameRingBuffer(num_of_slots=3)
+        self.assertIsNone(ring.get())
+        self.assertIsNone(ring.get_latest(timeout=0.01))
+
+        imgs = [np.full((2, 3, 3), i, np.uint8) for i in range(5)]
+        ring.put(imgs[0], timestamp=1.0)
+        frame = ring.get_latest(timeout=0.01)
+        self.assertEqual((frame.seq, frame.timestamp), (1, 1.0))
+        self.assertTrue(np.array_equal(frame.img, imgs[0]))
+        # no newer frame
+        self.assertIsNone(ring.get_latest(timeout=0.01))
+        self.assertEqual(ring.get_latest(newer_than=0, timeout=0.01).seq, 1)
+        self.assertEqual(ring.get().seq, 1)
+        self.assertEqual(ring.duplicates, 2)
+
+        # the frames 2 and 3 are overwritten without being returned
+        for i in range(1, 5):
+            ring.put(imgs[i], timestamp=1.0 + i)
+        frame = ring.get_latest(timeout=0.01)
+        self.assertEqual((frame.seq, frame.timestamp), (5, 5.0))
+        self.assertTrue(np.array_equal(frame.img, imgs[4]))
+        self.assertEqual(ring.dropped, 3)
+
+        # a view stays valid for num_of_slots - 1 further frames
+        view = ring.get_latest(newer_than=0, copy=False).img
+        ring.put(imgs[0])
+        ring.put(imgs[1])
+        self.assertTrue(np.array_equal(view, imgs[4]))
+        ring.put(imgs[2])
+        self.assertTrue(np.array_equal(view, imgs[2]))
+        self.assertEqual(ring.get().seq, 8)
+        self.assertEqual(ring.dropped, 5)
+
+        # a new shape reallocates the slots
+        ring.put(np.zeros((4, 4, 3), np.uint8))
+        self.assertEqual(ring.get().img.shape, (4, 4, 3))
+
+    def test_replay_stream(self):
+        """
+        Test that a CCameraStream streams all imgs of a CReplaySource
+        without camera
+        """
+        # pylint: disable=import-outside-toplevel
+        from camera_stream import CCameraStream, CReplaySource
+
+        imgs = [np.full((2, 3, 3), i, np.uint8) for i in range(3)]
+        stream = CCameraStream(source=CReplaySource(imgs, loop=False), fps=0)
+        stream.run()
+        values = []
+        while True:
+            running = stream.running  # before waiting, the source may end meanwhile
+            frame = stream.get_latest(timeout=0.1)
+            if frame is not None:
+                values.append(int(frame.img[0, 0, 0]))
+            elif not running:
+                break
+        stream.stop()
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(values[-1], 2)
+        report = stream.get_report()
+        self.assertEqual(report["frames"], 3)
+        self.assertEqual(report["dropped"], 3 - len(values))
+
+    def test_shared_frame_ring(self):
+        """
+        Test that the CSharedFrameRing never overwrites the latest frame
+        and returns copies to stream readers
+        """
+        # pylint: disable=import-outside-toplevel
+        from shared_frames import CSharedFrameRing
+
+        imgs = [np.full((2, 3, 3), i, np.uint8) for i in range(5)]
+        ring = CSharedFrameRing(imgs[0].shape, num_of_slots=2)
+        try:
+            self.assertIsNone(ring.get())
+            self.assertEqual(ring.put(imgs[1]), 1)
+            self.assertEqual(ring.put(imgs[2]), 2)
+            claimed = ring.claim_latest(timeout=0.01)
+            self.assertEqual(claimed.seq, 2)
+            self.assertIsNone(ring.claim_latest(timeout=0.01))
+
+            # the other slot holds the latest frame now, all slots are taken
+            self.assertEqual(ring.put(imgs[3]), 3)
+            self.assertEqual(ring.put(imgs[4]), 0)
+            frame = ring.claim_latest(timeout=0.01)
+            self.assertEqual(frame.seq, 3)
+            self.assertTrue(np.array_equal(claimed.img, imgs[2]))
+            ring.release(claimed)
+            ring.release(frame)
+            # frame 1 was never claimed, the fourth frame never written
+            self.assertEqual(ring.dropped, 2)
+
+            # copies for a stream reader, which can still be claimed
+            self.assertEqual(ring.put(imgs[4]), 4)
+            frame = ring.get_latest(timeout=0.01)
+            self.assertEqual(frame.seq, 4)
+            self.assertTrue(np.array_equal(frame.img, imgs[4]))
+            self.assertIsNone(ring.get_latest(timeout=0.01))
+            self.assertEqual(ring.get().seq, 4)
+            self.assertEqual(ring.duplicates, 1)
+            frame = ring.claim_latest(timeout=0.01)
+            self.assertEqual(frame.seq, 4)
+            ring.release(frame)
+        finally:
+            ring.close()
+
+    def test_rolling_histogram(self):
+        """
+        Test the percentiles of the CRollingHistogram window and the
+        stages of a CProfiler
+        """
+        # pylint: disable=import-outside-toplevel
+        import profiling
+
+        histogram = profiling.CRollingHistogram(window=4)
+        self.assertEqual((histogram.percentile(50), histogram.mean()), (0.0, 0.0))
+
+        for duration in (1.05e-3, 1.05e-3, 1.05e-3, 0.05):
+            histogram.add(duration)
+        # upper edge of the bin, at most one bin width above the duration
+        self.assertGreaterEqual(histogram.percentile(50), 1.05e-3)
+        self.assertLess(histogram.percentile(50), 1.05e-3 * 10 ** (1 / profiling.BINS_PER_DECADE))
+        self.assertEqual(histogram.percentile(75), histogram.percentile(50))
+        # clamped to the max duration
+        self.assertEqual(histogram.percentile(100), 0.05)
+
+        # the old durations leave the window, the max and count stay
+        for _ in range(4):
+            histogram.add(2e-3)
+        self.assertAlmostEqual(histogram.mean(), 2e-3)
+        self.assertGreaterEqual(histogram.percentile(100), 2e-3)
+        self.assertLess(histogram.percentile(100), 2.5e-3)
+        self.assertEqual((histogram.count, histogram.max), (8, 0.05))
+
+        # durations beyond the last bin
+        histogram.add(2 * profiling.MAX_DURATION)
+        self.assertAlmostEqual(histogram.percentile(100), profiling.MAX_DURATION)
+
+        # concurrent stages keep the bin counts consistent
+        histogram = profiling.CRollingHistogram(window=10)
+        threads = [
+            threading.Thread(target=lambda: [histogram.add(1e-3) for _ in range(2000)])
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(max(histogram.counts), 10)
+        self.assertEqual(min(histogram.counts), 0)
+        self.assertEqual(sum(histogram.counts), 10)
+
+        profiler = profiling.CProfiler(window=4)
+        timed_sum = profiler.timed("sum")(sum)
+        self.assertEqual(timed_sum([1, 2]), 3)
+        self.assertEqual(profiler.get_stats(), {})
+        profiler.enable()
+        with profiler.timer("outer"):
+            timed_sum([1, 2])
+        self.assertEqual(list(profiler.get_stats()), ["outer", "sum"])
+        self.assertEqual(profiler.get_stats()["sum"]["calls"], 1)
 
 if __name__ == '__main__':
     unittest.main()
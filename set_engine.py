@@ -1,6 +1,10 @@
 """"
 This module represents the game itself with card and rules
 """
+from functools import lru_cache
+from itertools import combinations
+import numpy as np
+import profiling
 
 possible_attributes = {
     "number": [1, 2, 3],
@@ -9,75 +13,176 @@ possible_attributes = {
     "color": ["red", "green", "purple"]
 }
 
+# Order of the attributes inside the integer encoding of a card
+ATTRIBUTE_KEYS = ("number", "symbol", "shading", "color")
+ATTRIBUTE_INDEX = {
+    key: {value: index for index, value in enumerate(possible_attributes[key])}
+    for key in ATTRIBUTE_KEYS
+}
+NUM_OF_CARDS = 3 ** len(ATTRIBUTE_KEYS)
+
+
+def values_to_id(values):
+    """
+    Returns the integer id (0..80) of the given attribute values in order
+    of ATTRIBUTE_KEYS or None if values are unset ("")
+
+    Raises ValueError for values which are no possible attributes
+    """
+    card_id = 0
+    complete = True
+    for key, value in zip(reversed(ATTRIBUTE_KEYS), reversed(values)):
+        try:
+            index = ATTRIBUTE_INDEX[key].get(value)
+        except TypeError:
+            raise ValueError from None
+        if index is None:
+            if value != "":
+                raise ValueError
+            complete = False
+            continue
+        card_id = card_id * 3 + index
+    return card_id if complete else None
+
 
 class CCard():
     """
     A class to represent a card.
 
+    Cards with all attributes set are interned: there is exactly one
+    CCard object for each of the 81 cards, CCard(...) only looks it up.
+
     ...
 
     Attributes
     ----------
+    _values: tuple
+        attribute values in order of ATTRIBUTE_KEYS, "" if unset
+    _card_id: int
+        integer id 0..80 (base-3 digits, "number" least significant)
+        or None if not all attributes are set
 
     Methods
     -------
     get_...:
         returns attribute value
     """
-    def __init__(self, number="", symbol="", shading="", color=""):
-        if not (
-            (number in possible_attributes["number"] or number=="")
-            and (symbol in possible_attributes["symbol"] or symbol=="")
-            and (shading in possible_attributes["shading"] or shading=="")
-            and (color in possible_attributes["color"] or color=="")
-        ):
-            raise ValueError
-
-        self.attributes = {
-            "number": number,
-            "symbol": symbol,
-            "shading": shading,
-            "color": color
-        }
+    __slots__ = ("_values", "_card_id")
+
+    _interned = {}
+
+    def __new__(cls, number="", symbol="", shading="", color=""):
+        values = (number, symbol, shading, color)
+        if cls is CCard:
+            try:
+                return CCard._interned[values]
+            except (KeyError, TypeError):
+                pass
+
+        card = super().__new__(cls)
+        card._card_id = values_to_id(values)
+        card._values = values
+        return card
+
+    def __getnewargs__(self):
+        """
+        Unpickling and copying of interned cards returns the interned card
+        """
+        return self._values
 
     def __eq__(self, other):
         """
         Replace default == method
         """
+        if self is other:
+            return True
         if not isinstance(other, CCard):
-            raise NotImplementedError
+            return NotImplemented
+
+        return self._values == other._values
+
+    def __hash__(self):
+        return hash(self._values)
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self._values}"
 
-        return self.get_attributes() == other.get_attributes()
+    def get_id(self):
+        """
+        Get integer id 0..80 of the card or None if not all attributes are set
+        """
+        return self._card_id
 
     def get_attributes(self):
         """
         Get all attributes as a dict
         """
-        return self.attributes
+        return dict(zip(ATTRIBUTE_KEYS, self._values))
 
     def get_number(self):
         """
         Get number of symbols of the card
         """
-        return self.attributes["number"]
+        return self._values[0]
 
     def get_symbol(self):
         """
         Get symbol of the card
         """
-        return self.attributes["symbol"]
+        return self._values[1]
 
     def get_shading(self):
         """
         Get shading of the symbol
         """
-        return self.attributes["shading"]
+        return self._values[2]
 
     def get_color(self):
         """
         Get color of the symbol
         """
-        return self.attributes["color"]
+        return self._values[3]
+
+
+def _intern_cards():
+    """
+    Create the 81 interned cards, returns them as tuple indexed by id
+    """
+    cards = []
+    for card_id in range(NUM_OF_CARDS):
+        values = []
+        code = card_id
+        for key in ATTRIBUTE_KEYS:
+            values.append(possible_attributes[key][code % 3])
+            code //= 3
+        card = CCard(*values)
+        CCard._interned[tuple(values)] = card
+        cards.append(card)
+    return tuple(cards)
+
+
+CARDS = _intern_cards()
+
+
+def _build_completion_table():
+    """
+    Returns the (81 x 81) table of card ids completing a pair to a SET
+
+    Per attribute the missing digit is (-a - b) mod 3:
+    equal digits stay equal, different digits lead to the third one.
+    """
+    weights = 3 ** np.arange(len(ATTRIBUTE_KEYS))
+    digits = np.arange(NUM_OF_CARDS)[:, np.newaxis] // weights % 3
+    missing = -(digits[:, np.newaxis, :] + digits[np.newaxis, :, :]) % 3
+    return (missing @ weights).astype(np.uint8)
+
+
+# COMPLETION_TABLE[id1, id2] is the id of the card completing the SET,
+# for id1 == id2 it is the card itself
+COMPLETION_TABLE = _build_completion_table()
+COMPLETION_TABLE.setflags(write=False)
+# Same table as flat list, index id1 * 81 + id2, faster for scalar lookups
+_COMPLETION_LIST = COMPLETION_TABLE.ravel().tolist()
 
 
 def check_val(val1, val2, val3):
@@ -107,6 +212,13 @@ def is_a_set(card1, card2, card3):
         # don't attempt to compare against unrelated types
         raise NotImplementedError
 
+    card_id1 = card1.get_id()
+    card_id2 = card2.get_id()
+    card_id3 = card3.get_id()
+    if card_id1 is not None and card_id2 is not None and card_id3 is not None:
+        return _COMPLETION_LIST[card_id1 * NUM_OF_CARDS + card_id2] == card_id3
+
+    # cards with unset attributes
     for key in card1.get_attributes():
         could_be_a_set = check_val(
             card1.get_attributes()[key],
@@ -120,30 +232,317 @@ def is_a_set(card1, card2, card3):
     return True
 
 
+def encode_card(card):
+    """
+    Encode the attributes of a card as integer in 0..80
+
+    Every attribute is one base-3 digit (index in possible_attributes),
+    "number" is the least significant digit.
+    Returns None if the card has unset attributes
+    """
+    return card.get_id()
+
+
+def decode_card(code):
+    """
+    Returns the interned CCard of the given integer code
+    """
+    if not 0 <= code < NUM_OF_CARDS:
+        raise ValueError
+    return CARDS[code]
+
+
+def complete_set_code(code1, code2):
+    """
+    Returns the code of the one card completing the two given cards to a SET
+    """
+    return _COMPLETION_LIST[code1 * NUM_OF_CARDS + code2]
+
+
+def complete_set(card1, card2):
+    """
+    Returns the card completing the two given cards to a SET
+    or None if a card has unset attributes
+    """
+    code1 = card1.get_id()
+    code2 = card2.get_id()
+    if code1 is None or code2 is None:
+        return None
+    return CARDS[_COMPLETION_LIST[code1 * NUM_OF_CARDS + code2]]
+
+
+def find_set_indices(codes):
+    """
+    Returns indices (i, j, k) with i < j < k of the first SET in the given
+    list of card codes or an empty tuple if no SET was found
+
+    Every pair of cards determines exactly one third card, so looking it
+    up in COMPLETION_TABLE and a dict of the field codes gives O(n²)
+    instead of O(n³).
+    Entries which are None (incomplete cards) are ignored.
+    """
+    positions = {}
+    for index, code in enumerate(codes):
+        if code is not None:
+            positions.setdefault(code, index)
+
+    for i, code1 in enumerate(codes):
+        if code1 is None:
+            continue
+        row = code1 * NUM_OF_CARDS
+        for j in range(i + 1, len(codes)):
+            code2 = codes[j]
+            if code2 is None or code2 == code1:
+                continue
+            k = positions.get(_COMPLETION_LIST[row + code2], -1)
+            if k > j:
+                return (i, j, k)
+    return ()
+
+
+@profiling.timed("solve")
+def find_set_indexed(cards):
+    """
+    Returns a list of 3 cards representing a SET
+    or an empty list if no SET was found
+    using the completion table
+    """
+    if len(cards) < 3:
+        return []
+    indices = find_set_indices([encode_card(card) for card in cards])
+    return [cards[i] for i in indices]
+
+
 def find_set_primitive_loop(cards):
     """
     Returns a list of 3 cards representing a SET
     or an empty list if no SET was found
+
+    Kept for compatibility, same as find_set_indexed
     """
-    counter = 0
-    if len(cards) >= 3:
-        for card1 in cards:
-            for card2 in cards:
-                for card3 in cards:
-                    counter += 1
-                    if card1 == card2 or card1 == card3 or card2 == card3:
-                        continue
-                    if is_a_set(card1, card2, card3):
-                        return [card1, card2, card3]
+    return find_set_indexed(cards)
+
+
+@profiling.timed("solve")
+def find_set_brute_force(cards):
+    """
+    Returns a list of 3 cards representing a SET
+    or an empty list if no SET was found
+
+    Checks every triple of cards with is_a_set, O(n³), kept as simple
+    reference for find_set_indexed, both return the same SET
+    """
+    for card1, card2, card3 in combinations(cards, 3):
+        if card1 == card2 or card1 == card3 or card2 == card3:
+            continue
+        if is_a_set(card1, card2, card3):
+            return [card1, card2, card3]
     return []
 
-def find_set_cnn(cards):
+
+def iter_set_indices(codes):
+    """
+    Generator yielding indices (i, j, k) with i < j < k of every SET in
+    the given list of card codes
+    """
+    positions = {}
+    for index, code in enumerate(codes):
+        if code is not None:
+            positions.setdefault(code, []).append(index)
+
+    for i, code1 in enumerate(codes):
+        if code1 is None:
+            continue
+        row = code1 * NUM_OF_CARDS
+        for j in range(i + 1, len(codes)):
+            code2 = codes[j]
+            if code2 is None or code2 == code1:
+                continue
+            for k in positions.get(_COMPLETION_LIST[row + code2], ()):
+                if k > j:
+                    yield (i, j, k)
+
+
+def iter_sets(cards):
+    """
+    Generator yielding every SET of the given cards as list of 3 cards
+    """
+    codes = [encode_card(card) for card in cards]
+    for indices in iter_set_indices(codes):
+        yield [cards[i] for i in indices]
+
+
+def find_all_sets(cards):
+    """
+    Returns a list of all SETs of the given cards,
+    every SET is a list of 3 cards
+    """
+    return list(iter_sets(cards))
+
+
+def count_sets(cards):
+    """
+    Returns the number of SETs of the given cards without building them
+    """
+    return count_set_codes([encode_card(card) for card in cards])
+
+
+def count_set_codes(codes):
+    """
+    Returns the number of SETs in the given list of card codes
+
+    Works on the distinct codes only, cards lying on the field more than
+    once are taken into account by multiplying their occurrences.
+    Entries which are None (incomplete cards) are ignored.
+    """
+    occurrences = {}
+    for code in codes:
+        if code is not None:
+            occurrences[code] = occurrences.get(code, 0) + 1
+
+    distinct = sorted(occurrences)
+    counter = 0
+    for i, code1 in enumerate(distinct):
+        row = code1 * NUM_OF_CARDS
+        for code2 in distinct[i + 1:]:
+            code3 = _COMPLETION_LIST[row + code2]
+            if code3 > code2 and code3 in occurrences:
+                counter += occurrences[code1] * occurrences[code2] * occurrences[code3]
+    return counter
+
+
+def cards_to_array(cards):
+    """
+    Returns the attribute indices of the given cards as (n_cards x 4) array,
+    columns in order of ATTRIBUTE_KEYS
+    """
+    codes = np.array([card.get_id() for card in cards], dtype=np.int8)
+    return codes_to_array(codes)
+
+
+def codes_to_array(codes):
+    """
+    Returns the attribute indices of the given card codes as
+    (... x 4) array, columns in order of ATTRIBUTE_KEYS
+    """
+    codes = np.asarray(codes)
+    digits = 3 ** np.arange(len(ATTRIBUTE_KEYS))
+    return (codes[..., np.newaxis] // digits % 3).astype(np.int8)
+
+
+@lru_cache(maxsize=None)
+def triple_index_table(n_cards):
+    """
+    Returns all index triples i < j < k of n_cards as (n_triples x 3) array
+    in the same order as itertools.combinations
+    """
+    table = np.array(list(combinations(range(n_cards), 3)), dtype=np.intp)
+    return table.reshape(-1, 3)
+
+
+def _packed_sum_is_set_table():
+    """
+    Returns a bool lookup table for the sum of three packed cards
+
+    A packed card holds every attribute index in its own 3 bit field,
+    the sum of three indices (at most 6) fits into 3 bits as well, so
+    all attributes are added at once without carry. The sum is a SET
+    if every field is divisible by 3.
+    """
+    shifts = np.arange(0, 3 * len(ATTRIBUTE_KEYS), 3)
+    packed_sums = np.arange(1 << (3 * len(ATTRIBUTE_KEYS)))
+    fields = packed_sums[:, np.newaxis] >> shifts & 0b111
+    return np.all(fields % 3 == 0, axis=1)
+
+
+PACKED_SUM_IS_SET = _packed_sum_is_set_table()
+PACKED_SHIFTS = np.arange(0, 3 * len(ATTRIBUTE_KEYS), 3, dtype=np.int16)
+
+
+def batch_set_mask(layouts, chunk_size=4096):
+    """
+    Returns a (n_layouts x n_triples) bool array marking the triples of
+    triple_index_table(n_cards) which are a SET
+
+    layouts is an integer array (n_layouts x n_cards x 4) of attribute
+    indices. Three values are all equal or all different exactly if
+    their sum is divisible by 3, so a triple is a SET if this holds for
+    all four attributes, the same as is_a_set.
+    The layouts are processed in chunks to limit the memory usage.
+    """
+    layouts = np.asarray(layouts)
+    if layouts.ndim != 3 or layouts.shape[2] != len(ATTRIBUTE_KEYS):
+        raise ValueError
+    packed = (layouts.astype(np.int16) << PACKED_SHIFTS).sum(axis=2, dtype=np.int16)
+    triples = triple_index_table(layouts.shape[1])
+    mask = np.empty((layouts.shape[0], len(triples)), dtype=bool)
+
+    for start in range(0, layouts.shape[0], chunk_size):
+        chunk = packed[start:start + chunk_size]
+        sums = chunk[:, triples[:, 0]] + chunk[:, triples[:, 1]] + chunk[:, triples[:, 2]]
+        mask[start:start + chunk_size] = PACKED_SUM_IS_SET[sums]
+    return mask
+
+
+def batch_find_sets(layouts, chunk_size=4096):
+    """
+    Solve many layouts at once
+
+    Returns a tuple of
+    - has_set: (n_layouts) bool array
+    - counts: (n_layouts) array with the number of SETs
+    - first: (n_layouts x 3) array with the card indices of the first SET
+      or -1 if there is no SET, for layouts without duplicate cards this
+      is the same as find_set_indices
+    """
+    layouts = np.asarray(layouts)
+    mask = batch_set_mask(layouts, chunk_size)
+    counts = mask.sum(axis=1)
+    has_set = counts > 0
+
+    first = np.full((len(mask), 3), -1, dtype=np.intp)
+    if mask.shape[1] > 0:
+        triples = triple_index_table(layouts.shape[1])
+        first[has_set] = triples[mask[has_set].argmax(axis=1)]
+    return has_set, counts, first
+
+
+@profiling.timed("solve")
+def find_set_cnn(cards, model=None):
     """
     Returns a list of 3 cards representing a SET
     or an empty list if no SET was found
-    using a CNN
+    using the learned card scorer of card_cnn on the flattened card
+    images (CQueryCard.get_warp) instead of the card attributes
     """
-    pass
+    # card_cnn needs OpenCV and a trained model, only load it if used
+    import card_cnn  # pylint: disable=import-outside-toplevel
+
+    if len(cards) < 3:
+        return []
+    if model is None:
+        model = card_cnn.get_model()
+    codes = model.predict_ids([card.get_warp(card_cnn.WARP_SIZE) for card in cards]).tolist()
+    return [cards[i] for i in find_set_indices(codes)]
+
+
+# Interchangeable SET search functions, all take a list of cards and
+# return a list of 3 cards or an empty list
+SOLVERS = {
+    "primitive": find_set_brute_force,
+    "indexed": find_set_indexed,
+    "cnn": find_set_cnn,
+}
+
+
+def get_solver(name):
+    """
+    Returns the SET search function of the given name, see SOLVERS
+    """
+    if name not in SOLVERS:
+        raise ValueError(f"Unknown solver '{name}', possible: {', '.join(SOLVERS)}")
+    return SOLVERS[name]
+
 
 def show_cards(cards):
     """
@@ -0,0 +1,310 @@
+"""Module to hand frames to card detection processes via shared memory
+
+The capture side writes every frame once into a slot of a CSharedFrameRing,
+detection worker processes read it as NumPy view without copying or
+pickling it. A slot is pinned while it is read, so the writer only
+overwrites slots nobody reads. The workers send back compact records of
+the cards (corners, center, card id) instead of images.
+"""
+import os
+import queue
+import time
+from collections import namedtuple
+from multiprocessing import Condition, Event, Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import set_engine
+from camera_stream import CameraFrame
+
+# Frame of the CSharedFrameRing, img is a view of the shared slot
+SharedFrame = namedtuple("SharedFrame", ["seq", "timestamp", "img", "slot"])
+
+# Result of a detection worker, records of dtype CARD_RECORD
+DetectionResult = namedtuple("DetectionResult", ["seq", "timestamp", "records"])
+
+# Compact record of a detected card, card_id -1 if not all attributes are known
+CARD_RECORD = np.dtype([
+    ("corners", np.float32, (4, 2)),
+    ("center", np.int32, 2),
+    ("card_id", np.int8),
+    ("in_set", np.bool_),
+])
+
+# header fields, followed by seq and readers of every slot
+_LATEST = 0 # seq of the latest frame
+_CLAIMED = 1 # seq of the latest frame claimed by a worker
+_DELIVERED = 2 # number of frames claimed
+_NOT_WRITTEN = 3 # number of frames put dropped because all slots were pinned
+_DUPLICATES = 4 # number of frames get or get_latest returned more than once
+_HEADER_FIELDS = 5
+_ALIGN = 64
+
+
+def _slots_offset(num_of_slots):
+    """Returns the aligned byte offset of the slots behind the header"""
+    header_size = 8 * (_HEADER_FIELDS + 3 * num_of_slots)
+    return -(-header_size // _ALIGN) * _ALIGN
+
+
+class CSharedFrameRing:
+    """Fixed number of frame slots in shared memory, usable from all
+    processes it is passed to, with one writing process. Frames are
+    numbered from 1 by their sequence number. The latest frame is never
+    overwritten, so it can always be pinned."""
+    def __init__(self, shape, num_of_slots=4):
+        if num_of_slots < 2:
+            raise ValueError("CSharedFrameRing needs at least 2 slots")
+        self.shape = tuple(shape)
+        self.num_of_slots = num_of_slots
+        self.cond = Condition()
+        self.shm = SharedMemory(
+            create=True,
+            size=_slots_offset(num_of_slots) + num_of_slots * int(np.prod(self.shape)))
+        self.owner_pid = os.getpid()
+        self.last_returned = 0 # seq of the latest frame get_latest returned in this process
+        self.__map()
+        self.header[:] = 0
+
+    def __map(self):
+        """Create the NumPy views of header and slots"""
+        ints = _HEADER_FIELDS + 2 * self.num_of_slots
+        self.header = np.ndarray((ints,), np.int64, self.shm.buf)
+        self.timestamps = np.ndarray((self.num_of_slots,), np.float64, self.shm.buf, 8 * ints)
+        self.slots = np.ndarray(
+            (self.num_of_slots,) + self.shape, np.uint8, self.shm.buf,
+            _slots_offset(self.num_of_slots))
+
+    def __getstate__(self):
+        return {"name": self.shm.name, "shape": self.shape,
+                "num_of_slots": self.num_of_slots, "cond": self.cond}
+
+    def __setstate__(self, state):
+        self.shape = state["shape"]
+        self.num_of_slots = state["num_of_slots"]
+        self.cond = state["cond"]
+        # worker processes share the resource tracker of the creating
+        # process, so attaching does not register the memory twice
+        self.shm = SharedMemory(state["name"])
+        self.owner_pid = None
+        self.last_returned = 0
+        self.__map()
+
+    def __slot_seq(self, slot):
+        return _HEADER_FIELDS + slot
+
+    def __slot_readers(self, slot):
+        return _HEADER_FIELDS + self.num_of_slots + slot
+
+    def put(self, img, timestamp=None):
+        """Copy img into the oldest slot nobody reads, except the one of
+        the latest frame, returns its sequence number or 0 if all other
+        slots are pinned (frame dropped)"""
+        header = self.header
+        with self.cond:
+            free = [slot for slot in range(self.num_of_slots)
+                    if header[self.__slot_readers(slot)] == 0
+                    and (header[_LATEST] == 0 or header[self.__slot_seq(slot)] != header[_LATEST])]
+            if not free:
+                header[_NOT_WRITTEN] += 1
+                return 0
+            slot = min(free, key=lambda slot: header[self.__slot_seq(slot)])
+            header[self.__slot_seq(slot)] = 0 # invalid while writing
+        np.copyto(self.slots[slot], img)
+        with self.cond:
+            seq = header[_LATEST] + 1
+            self.timestamps[slot] = time.perf_counter() if timestamp is None else timestamp
+            header[self.__slot_seq(slot)] = seq
+            header[_LATEST] = seq
+            self.cond.notify_all()
+        return seq
+
+    def claim_latest(self, timeout=None):
+        """Returns the latest SharedFrame no other reader claimed yet,
+        so every frame goes to at most one worker. Waits for a new frame,
+        None after timeout seconds. The frame has to be released."""
+        header = self.header
+        with self.cond:
+            if not self.cond.wait_for(lambda: header[_LATEST] > header[_CLAIMED], timeout):
+                return None
+            frame = self.__pin(header[_LATEST])
+            header[_CLAIMED] = frame.seq
+            header[_DELIVERED] += 1
+            return frame
+
+    def get_latest(self, newer_than=None, timeout=None):
+        """Returns a copy of the latest frame as camera_stream.CameraFrame
+        like CFrameRingBuffer.get_latest, waits for a frame newer than
+        newer_than (by default the last one returned in this process),
+        None after timeout seconds. The frame can still be claimed."""
+        if newer_than is None:
+            newer_than = self.last_returned
+        header = self.header
+        with self.cond:
+            if not self.cond.wait_for(lambda: header[_LATEST] > newer_than, timeout):
+                return None
+            frame = self.__pin(header[_LATEST])
+        return self.__copy(frame)
+
+    def get(self):
+        """Returns a copy of the latest frame as camera_stream.CameraFrame
+        without waiting, None before the first frame"""
+        with self.cond:
+            if self.header[_LATEST] == 0:
+                return None
+            frame = self.__pin(self.header[_LATEST])
+        return self.__copy(frame)
+
+    def __copy(self, frame):
+        try:
+            img = frame.img.copy()
+        finally:
+            self.release(frame)
+        if frame.seq <= self.last_returned:
+            with self.cond:
+                self.header[_DUPLICATES] += 1
+        self.last_returned = max(self.last_returned, frame.seq)
+        return CameraFrame(frame.seq, frame.timestamp, img)
+
+    def get_frame(self, seq):
+        """Returns the SharedFrame of seq if it is still in the ring,
+        otherwise None. The frame has to be released."""
+        with self.cond:
+            if seq <= 0 or seq > self.header[_LATEST]:
+                return None
+            return self.__pin(seq)
+
+    def __pin(self, seq):
+        for slot in range(self.num_of_slots):
+            if self.header[self.__slot_seq(slot)] == seq:
+                self.header[self.__slot_readers(slot)] += 1
+                return SharedFrame(int(seq), float(self.timestamps[slot]), self.slots[slot], slot)
+        return None
+
+    def release(self, frame):
+        """Unpin the slot of a SharedFrame, its img must not be used anymore"""
+        with self.cond:
+            self.header[self.__slot_readers(frame.slot)] -= 1
+
+    @property
+    def seq(self):
+        """Sequence number of the latest frame"""
+        return int(self.header[_LATEST])
+
+    @property
+    def dropped(self):
+        """Frames which were never claimed, also the ones put could not
+        write because all slots were pinned"""
+        return int(self.header[_LATEST] - self.header[_DELIVERED] + self.header[_NOT_WRITTEN])
+
+    @property
+    def duplicates(self):
+        """Frames returned more than once by get or get_latest in any
+        process, claim_latest hands out every frame only once"""
+        return int(self.header[_DUPLICATES])
+
+    def close(self):
+        """Unmap the shared memory, the creating process also frees it"""
+        del self.header, self.timestamps, self.slots
+        self.shm.close()
+        if self.owner_pid == os.getpid():
+            self.shm.unlink()
+
+
+def cards_to_records(cards, set_cards=()):
+    """Returns the CARD_RECORD array of the detected cards"""
+    records = np.zeros(len(cards), CARD_RECORD)
+    in_set = {id(card) for card in set_cards}
+    for record, card in zip(records, cards):
+        record["corners"] = np.reshape(card.corner_pts, (4, 2))
+        record["center"] = card.center
+        card_id = card.get_id()
+        record["card_id"] = -1 if card_id is None else card_id
+        record["in_set"] = id(card) in in_set
+    return records
+
+
+def records_to_cards(records):
+    """Returns the query cards and the SET of a CARD_RECORD array,
+    without any images"""
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CQueryCard
+    cards = [CQueryCard.from_record(record) for record in records]
+    set_cards = [card for card, record in zip(cards, records) if record["in_set"]]
+    return cards, set_cards
+
+
+def create_card_detector():
+    """Default card detector of the detection workers"""
+    # pylint: disable=import-outside-toplevel
+    from card_detection import CCardDetector, CSceneChangeGate
+    from card_tracking import CCardTracker
+    return CCardDetector(tracker=CCardTracker(), gate=CSceneChangeGate())
+
+
+def _detect_frames(ring, results, stop_event, create_detector, solver):
+    # pylint: disable=import-outside-toplevel
+    from card_tracking import CSetCache
+    card_detector = create_detector()
+    find_set = set_engine.get_solver(solver)
+    if card_detector.tracker is not None:
+        find_set = CSetCache(find_set).get_set
+    try:
+        while not stop_event.is_set():
+            frame = ring.claim_latest(timeout=0.1)
+            if frame is None:
+                continue
+            try:
+                cards = card_detector.get_cards_from_img(frame.img)
+                records = cards_to_records(cards, find_set(cards))
+            finally:
+                ring.release(frame)
+            results.put(DetectionResult(frame.seq, frame.timestamp, records))
+    finally:
+        card_detector.close()
+
+
+def detection_worker(ring, results, stop_event, create_detector, solver):
+    """Detect the cards of claimed frames until stop_event is set"""
+    # the detector may keep views of the shared frames, drop it before
+    # the shared memory is closed
+    _detect_frames(ring, results, stop_event, create_detector, solver)
+    ring.close()
+
+
+class CSharedFrameDetection:
+    """Card detection in worker processes on the frames of a CSharedFrameRing"""
+    def __init__(self, ring, workers=1, create_detector=create_card_detector,
+                 solver="indexed"):
+        """create_detector() returns the CCardDetector of a worker, it has
+        to be a module level function, solver a name of set_engine.SOLVERS"""
+        self.ring = ring
+        self.results = Queue(maxsize=2 * workers)
+        self.stop_event = Event()
+        self.processes = [
+            Process(target=detection_worker,
+                    args=(ring, self.results, self.stop_event, create_detector, solver),
+                    daemon=True)
+            for _ in range(workers)
+        ]
+
+    def run(self):
+        """Start the worker processes"""
+        for process in self.processes:
+            process.start()
+
+    def get_result(self, timeout=None):
+        """Returns the next DetectionResult, results of several workers
+        may arrive out of order, raises queue.Empty after timeout"""
+        return self.results.get(timeout=timeout)
+
+    def stop(self):
+        """Stop the worker processes"""
+        self.stop_event.set()
+        for process in self.processes:
+            # unblock workers waiting to put a result
+            while process.is_alive():
+                try:
+                    self.results.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            process.join()
@@ -9,7 +9,7 @@ CamStream.run()
 time.sleep(3)
 
 while True:
-    img = CamStream.get()
+    img = CamStream.get_latest(timeout=1).img
     cv.namedWindow("window", cv.WND_PROP_FULLSCREEN)
     cv.setWindowProperty("window",
                          cv.WND_PROP_FULLSCREEN, cv.WINDOW_FULLSCREEN)
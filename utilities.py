@@ -1,8 +1,10 @@
 import cv2 as cv
 import numpy as np
+import profiling
 
 FONT = cv.FONT_HERSHEY_SIMPLEX
 
+@profiling.timed("draw.contours")
 def draw_card_contours(raw: list, qcards: list, color: tuple):
     # Draw card contours on image (have to do contours all at once or
     # they do not show up properly for some reason)
@@ -13,11 +15,13 @@ def draw_card_contours(raw: list, qcards: list, color: tuple):
         cv.drawContours(raw,temp_cnts, -1, (0,0,0), 3)
         cv.drawContours(raw,temp_cnts, -1, color, 2)
 
+@profiling.timed("draw.num_of_cards")
 def draw_num_of_cards(raw, qcards):
     cv.putText(raw, (f"Detected Cards: {len(qcards)}"),
             (3, 24), FONT, 1, (255, 255, 0), 2, cv.LINE_AA)
 
 
+@profiling.timed("draw.attributes")
 def draw_attributes(raw: list, qcards: list):
     """Draw the card name, center point, and contour on the camera img_raw."""
 
@@ -34,6 +38,7 @@ def draw_attributes(raw: list, qcards: list):
             (3, 24), FONT, 1, (255, 255, 0), 2, cv.LINE_AA)
 
 
+@profiling.timed("draw.card_imgs")
 def show_img_from_cards(qcards: list, img_name: str, win_name: str, size_wh: tuple):
     imgs = get_img_from_cards(qcards, img_name, size_wh)
 
@@ -47,10 +52,18 @@ def show_img_from_cards(qcards: list, img_name: str, win_name: str, size_wh: tup
 def get_img_from_cards(qcards: list, img_name: str, size_wh: tuple):
     img_list = []
     for card in qcards:
-        img_list.append(cv.resize(getattr(card, img_name), size_wh))
+        img_list.append(cv.resize(card.get_img(img_name), size_wh))
     return tuple(img_list)
 
 
+def draw_profile(raw, lines, size=0.7):
+    """Draw the lines of profiling.CProfiler.get_overlay_lines
+    below the number of detected cards"""
+    line_height = int(30 * size) + 4
+    for i, line in enumerate(lines):
+        put_text(raw, line, 3, 60 + i * line_height, size)
+
+
 def put_text_centered(img, text, center_x, center_y, size=1):
     """Put text into the given img centered to given x and y coordinates"""
     # get boundary of the text